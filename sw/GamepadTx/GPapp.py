@@ -11,37 +11,31 @@
 # Copyright:   (c) Bernd Hinze 2020
 # Licence:     MIT see https://opensource.org/licenses/MIT
 # ---------------------------------------------------------------------------- 
-import netifaces as ni
 import socket
 from time import time, sleep
-from os import system
-from threading import Thread
+from os import system, path
+from threading import Thread, Event
 from evdev import InputDevice
 import queue
+import struct
 import GPcfg
+import netstate
+import flightrec
 
 # Installation of evdev:
 #    sudo pip install evdev
 # First check the gamepad configuration with 
 #   ls /dev/input
 
-q_aloop = queue.LifoQueue(100)
-q_eloop = queue.Queue(20)
+# button events of the GP_loop, all pending events are processed per cycle
+# (the stick positions are written by the GP_loop into in_idx directly)
+q_eloop = queue.Queue(100)
 q_observer = queue.LifoQueue(20)
 q_obs_to_Udp_loop = queue.Queue(20)
+# set by the GP_loop on each input event, wakes the UDP_run (GPcfg.DELTA)
+tx_event = Event()
 
 # -----------  Utilities ----------------------
-def get_bc_address(ifname):
-    ip = get_ip_address(ifname).split('.')
-    bcip = ip[0] + '.' + ip[1] + '.' + ip[2] + '.' + '255'
-    return bcip
-    
-def get_ip_address(ifname):
-    try:
-        return ni.ifaddresses(ifname)[ni.AF_INET][0]['addr']
-    except:
-        return "127.0.0.0"
-    
 def bytostr(inp):
     '''Converts an integer < 256 into a coded string'''
     if (inp < 256):
@@ -60,6 +54,10 @@ def strtobyte (codstr):
 RED, GREEN, YELLOW = range(3)
 # indizes of analog event list in GPcfg.py
 CH, IV, DR, MIN, MAX = range(5)
+# optional curve parameters of the analog events in % 
+# deadzone, expo, endpoint of the lower and of the upper half 
+DZ, EXPO, EPL, EPH = range(5, 9)
+CURVE_DEFAULT = (0, 0, 100, 100)
 # some states
 shutdown = False
 Trtel_update = False
@@ -76,84 +74,193 @@ lenTel = len(screen_dat)
 ID, IP1, IP2, IP3, IP4, COS , SVAL1, SVAL2, START = range(9)
 
 sCH, sDR, sTR, sVAL = range(4)
-# default contro vaues for 16 channes
-contr_dat = [127, 127, 127, 127, 127, 127, 127, 127, \
-                 127, 127, 127, 127, 127, 127, 127, 127]
-# default trimm values for 16 channes
-trim_dat = [25 , 25, 25, 25, 25, 25, 25, 25, 25, 25, 25, 25, 25, 25, 25, 25]
+# count of channels, receivers with more than one PCA9685 board use 
+# the channels 16..63
+NCHAN = 64
+# position of each analog event {eventcode : GP value - MIN}, 
+# written by the GP_loop (single writer, no lock needed)
+in_idx = {}
+# default trimm values for all channes
+trim_dat = [25] * NCHAN
 # mapping dictionary, for each anaog event code to map the GP output from 
 # -128 .. 0  ...127 to the range of 0..254 with center value = 127
+# including the curve of the event, dict_ValCorrDR with dual rate
 dict_ValCorr = {}
+dict_ValCorrDR = {}
+# table in use for each analog event, switched by the dual rate buttons
+val_tab = {}
 lockup = ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9",
                        ":", ";", "<", "=", ">", "?"]
+# coded strings of all byte values for the string coded telegrams
+strtab = [bytostr(i) for i in range(256)]
 CENTER = 127
+# Binary control telegram, version 2 - see rcapp.decode_Tel2 
+#   TEL2_MAGIC, version, flags, seq, time stamp in ms, [receiver ID], nmap, 
+#   bitmap[nmap], values, ntrim, (chan, trim) * ntrim, ncmd, (chan, val) * ncmd
+# F_TM: the telemetry telegram is accepted, the receivers send it to us only
+TEL2_MAGIC = 0xB2
+TEL_VERSION = 2
+F_SEQ = 0x02
+F_ADDR = 0x04
+F_TM = 0x08
+# sequence numbers of the control telegrams for each receiver ID 
+# (0 = broadcast), every receiver checks its own sequence
+tel_seq = {}
+SEQ_TS = struct.Struct('>HI')
+# header templates of the binary telegram for each receiver ID, only the
+# sequence number and the time stamp are packed into it per telegram
+tel_hdr = {}
+# channel values of the last telegram for each receiver ID (GPcfg.DELTA)
+tx_sent = {}
+# receivers found by their Rx_BC telegrams {receiver ID : [ip, version]}
+rx_table = {}
+# Binary telemetry telegram of the receivers - see rcapp.telemetry
+TM_MAGIC = 0xB3
+TM_HDR = struct.Struct('>BBBBIIIHHBbbB')
+TM_AIN = struct.Struct('>Bh')
+TM_FAILSAFE = 0x01
+# last telemetry of each receiver {receiver ID : dict of decode_telemetry}
+rx_telemetry = {}
 # -----------  End Global data definition ----------------------
                 
 def update_data():
-    ''' updates the contr_dat[] and trim_dat[] by receiving data via queues
-        from the GP_loop()
+    ''' updates the trim_dat[] and the states by processing all button 
+        events received via queue from the GP_loop()
     '''
+    while True:
+        try:
+            code, value = q_eloop.get(block=False)
+        except queue.Empty:
+            return
+        button_event(code, value)
+
+def button_event(code, value):
+    '''Trimming, dual rate and shutdown'''
     global shutdown, Trtel_update, screen_dat, trim_dat
-    if (not q_aloop.empty()):
-        code, value = q_aloop.get()
-        #print ('get_q', code, value)
-        if code in GPcfg.analogEvent:
-            chan = GPcfg.analogEvent[code][CH]
-            gval = value - GPcfg.analogEvent[code][MIN]
-            contr_dat[chan] = dict_ValCorr[code][gval]                                            
-    while(not q_aloop.empty()):                             
-        tmp = q_aloop.get() 
+    if (code in GPcfg.trimEvent) and (value == 1):
+        chan = GPcfg.trimEvent[code][0]
+        trim_dat[chan] += GPcfg.trimEvent[code][1]
+        if trim_dat[chan] > 50:
+            trim_dat[chan] = 50
+        elif trim_dat[chan] < 0:
+            trim_dat[chan] = 0
+        Trtel_update = True
         
-    if (not q_eloop.empty()):
-        code, value = q_eloop.get()
-        if (code in GPcfg.trimEvent) and (value == 1):
-            chan = GPcfg.trimEvent[code][0]
-            trim_dat[chan] += GPcfg.trimEvent[code][1]
-            if trim_dat[chan] > 50:
-                trim_dat[chan] = 50
-            elif trim_dat[chan] < 0:
-                trim_dat[chan] = 0
-            Trtel_update = True
-            
-        elif (code == GPcfg.shutdEvent):
-            shutdown = True  
-            
-        elif (code in GPcfg.duraEvent) and (value == 1):   
-            drev = GPcfg.duraEvent[code]
-            GPcfg.analogEvent[drev][DR] = not GPcfg.analogEvent[drev][DR]
-            #print (GPcfg.analogEvent[drev])
-            ch = GPcfg.analogEvent[drev][0]
-            if ch == 0:
-                if GPcfg.analogEvent[drev][DR]: 
-                    screen_dat[START+1] = GPcfg.DualRate                           
-                else:
-                    screen_dat[START+1] = 100
-            if ch == 3:
-                if GPcfg.analogEvent[drev][DR]: 
-                    screen_dat[START+5] = GPcfg.DualRate 
-                else:
-                    screen_dat[START+5] = 100   
+    elif (code == GPcfg.shutdEvent):
+        shutdown = True  
+        
+    elif (code in GPcfg.duraEvent) and (value == 1):   
+        drev = GPcfg.duraEvent[code]
+        GPcfg.analogEvent[drev][DR] = not GPcfg.analogEvent[drev][DR]
+        select_tab(drev)
+        #print (GPcfg.analogEvent[drev])
+        ch = GPcfg.analogEvent[drev][0]
+        if ch == 0:
+            if GPcfg.analogEvent[drev][DR]: 
+                screen_dat[START+1] = GPcfg.DualRate                           
+            else:
+                screen_dat[START+1] = 100
+        if ch == 3:
+            if GPcfg.analogEvent[drev][DR]: 
+                screen_dat[START+5] = GPcfg.DualRate 
+            else:
+                screen_dat[START+5] = 100   
 
-def Trimm_update():   
+def Trimm_update(chans=None):   
     global screen_dat
     tel = "" 
     for event in GPcfg.analogEvent:
         ch = GPcfg.analogEvent[event][0]
+        if (chans is not None) and (ch not in chans):
+            continue
         val = trim_dat[ch] 
-        tel = tel + "7?" + bytostr(ch) + bytostr(val)
+        tel = tel + "7?" + strtab[ch] + strtab[val]
         if ch == 3:
             screen_dat[START + sTR + 4] = val 
     return tel    
 
 
-def Control_update():
-    tel = chr(2) + "02" 
+def Trimm_update2(chans=None):
+    '''Trim records of the binary telegram'''
+    global screen_dat
+    tel = bytearray([0]) 
     for event in GPcfg.analogEvent:
         ch = GPcfg.analogEvent[event][CH]
-        val = contr_dat[ch] 
-        if GPcfg.analogEvent[event][DR] == True:
-            val = CENTER + round((val - CENTER) * GPcfg.DualRate / 100)
-        tel = tel + "??" + bytostr(ch) + bytostr(val)               
+        if (chans is not None) and (ch not in chans):
+            continue
+        val = trim_dat[ch] 
+        tel.extend((ch, val))
+        tel[0] += 1
+        if ch == 3:
+            screen_dat[START + sTR + 4] = val 
+    return tel
+
+def chan_vals(chans=None):
+    '''Current control values {channel : value} including the dual rate'''
+    vals = {}
+    for event in GPcfg.analogEvent:
+        ch = GPcfg.analogEvent[event][CH]
+        if (chans is not None) and (ch not in chans):
+            continue
+        vals[ch] = val_tab[event][in_idx[event]]
+    return vals
+
+def changed_vals(rx_id, chans=None, full=True):
+    '''Control values that differ from the last telegram to the receiver,
+    full => all values
+    '''
+    vals = chan_vals(chans)
+    sent = tx_sent.setdefault(rx_id, {})
+    if not full:
+        vals = {ch: vals[ch] for ch in vals if sent.get(ch) != vals[ch]}
+    sent.update(vals)
+    return vals
+
+def tel2_header(rx_id):
+    '''Header template of the receiver with the next sequence number'''
+    hdr = tel_hdr.get(rx_id)
+    if hdr is None:
+        if rx_id:
+            hdr = bytearray((TEL2_MAGIC, TEL_VERSION, F_SEQ | F_ADDR | F_TM,
+                             0, 0, 0, 0, 0, 0, rx_id))
+        else:
+            hdr = bytearray((TEL2_MAGIC, TEL_VERSION, F_SEQ | F_TM,
+                             0, 0, 0, 0, 0, 0))
+        tel_hdr[rx_id] = hdr
+    seq = (tel_seq.get(rx_id, 0) + 1) & 0xFFFF
+    tel_seq[rx_id] = seq
+    SEQ_TS.pack_into(hdr, 3, seq, int(time() * 1000) & 0xFFFFFFFF)
+    return hdr
+
+def Control_update2(trim=False, rx_id=0, chans=None, vals=None):
+    '''Creates the binary control telegram (version 2)
+    rx_id != 0 => addressed to this receiver, chans = channels of the 
+    receiver, vals = values to be sent (default all channels of chans)
+    '''
+    if vals is None:
+        vals = chan_vals(chans)
+    bitmap = 0
+    for ch in vals:
+        bitmap |= 1 << ch
+    nmap = (bitmap.bit_length() + 7) // 8
+    tel = bytearray(tel2_header(rx_id))
+    tel.append(nmap)
+    tel += bitmap.to_bytes(nmap, 'little')
+    for ch in sorted(vals):
+        tel.append(vals[ch])
+    if trim:
+        tel += Trimm_update2(chans)
+    else:
+        tel.append(0)
+    tel.append(0)   # no command records
+    return tel
+
+def Control_update(chans=None, vals=None):
+    if vals is None:
+        vals = chan_vals(chans)
+    tel = chr(2) + "02" 
+    for ch in vals:
+        tel = tel + "??" + strtab[ch] + strtab[vals[ch]]               
     return tel
    
 
@@ -163,37 +270,44 @@ sock.bind((GPcfg.gamepad_addr))
    
 def UDP_run():
     print('Udp running')
-    global  Trtel_update, screen_dat  
+    global  Trtel_update, screen_dat
     rx_port = GPcfg.receiver_port
     screen_port = GPcfg.screen_port     
-    bc_ip = get_bc_address(GPcfg.ifname)
+    bc_ip = netstate.broadcast
     screen_ip = bc_ip
     rx_ip = bc_ip 
+    net_version = netstate.version
     t_screen_sent = time()
     t_BC_sent = time()
+    t_full = 0.0
         
-    def Tx_BC():
+    def make_Tx_BC():
         """Creates the string coded telegram including the owne IP - Tx_BC
         """
         tel = ""
-        ip = get_ip_address(GPcfg.ifname).split('.')    
+        ip = netstate.addr.split('.')    
         tel = chr(2) + "03"
         for i in range (len(ip)):
             tel = tel + bytostr(int(ip[i]))
         tel = tel + chr(13)
         return tel  
 
-    Tx_BC = Tx_BC().encode('utf-8')        
+    Tx_BC = make_Tx_BC().encode('utf-8')        
         
-    def mess_to_receiver(ip, port):
-        global Trtel_update
-        tel = Control_update()       
-        if Trtel_update:
-            tel = tel + Trimm_update() 
-            Trtel_update = False
-        tel = tel + chr(13)
+    def mess_to_receiver(ip, port, version, rx_id=0, chans=None, full=True):
+        vals = changed_vals(rx_id, chans, full)
+        if not vals and not Trtel_update:
+            return
+        if (version >= TEL_VERSION):
+            tel = Control_update2(Trtel_update, rx_id, chans, vals)
+        else:
+            tel = Control_update(chans, vals)       
+            if Trtel_update:
+                tel = tel + Trimm_update(chans) 
+            tel = (tel + chr(13)).encode('utf-8')
         try: 
-            sent = sock.sendto(tel.encode('utf-8'), (ip, port))
+            sent = sock.sendto(tel, (ip, port))
+            flightrec.telegram(tel, ip)
         except: 
             print("Failed telegram RC  " + str(ip))
         #print (tel)
@@ -234,22 +348,36 @@ def UDP_run():
         for i in range(3):
             try: 
                 sent = sock.sendto(rcsd_tel.encode('utf-8'), (ip, port))
+                flightrec.telegram(rcsd_tel.encode('utf-8'), ip)
             except: 
                 print("Failed telegram Shutdown")        
             sleep(0.5)          
+        flightrec.close()
         if (GPcfg.PC == False):
             system("sudo shutdown now")
         print("Shutdown")            
   
     # ----------- running loop ---------------------------      
     while (not shutdown):  
+        if (netstate.version != net_version):
+            # own address changed => Tx_BC with the new address immediately,
+            # addresses not learned yet follow the new broadcast address
+            net_version = netstate.version
+            if (screen_ip == bc_ip):
+                screen_ip = netstate.broadcast
+            if (rx_ip == bc_ip):
+                rx_ip = netstate.broadcast
+            bc_ip = netstate.broadcast
+            Tx_BC = make_Tx_BC().encode('utf-8')
+            t_BC_sent = 0.0
         if (not q_obs_to_Udp_loop.empty()):
-            ID, ip = q_obs_to_Udp_loop.get()
+            ID, ip, version, rx_id = q_obs_to_Udp_loop.get()
             if (ID == 5) :
                 screen_ip = ip
                 #print ("Screen IP", screen_ip)
             if (ID == 1):  
                 rx_ip = ip
+                rx_table[rx_id] = [ip, version]
                 #print ("Rx IP", rx_ip)
                 
                      
@@ -267,32 +395,92 @@ def UDP_run():
                 print("Failed data telegram to sreen") 
        
         update_data()              
-        mess_to_receiver(bc_ip, rx_port)  
-        t_rx_sent = time()
-        sleep(0.03)    
+        # DELTA => changed channels only, all channels as keep alive
+        full = (not GPcfg.DELTA) or ((time() - t_full) >= GPcfg.KEEPALIVE)
+        if full:
+            t_full = time()
+        if GPcfg.receivers:
+            for rx_id in GPcfg.receivers:
+                if rx_id in rx_table:
+                    ip, version = rx_table[rx_id]
+                    mess_to_receiver(ip, rx_port, version, rx_id, 
+                                     GPcfg.receivers[rx_id], full)
+        else:
+            # version 1 receivers fail on binary telegrams, a receiver may
+            # power up before its Rx_BC is seen => the broadcast is ASCII
+            mess_to_receiver(bc_ip, rx_port, 1, 0, None, full)  
+        Trtel_update = False
+        if GPcfg.DELTA:
+            # sent immediately on the next input event
+            tx_event.wait(max(0.0, t_full + GPcfg.KEEPALIVE - time()))
+            tx_event.clear()
+        else:
+            sleep(0.03)    
         
     # shutdown cmd by pressing shutdown button    
     sent_shutdown(bc_ip, rx_port)
 
                  
+def voltotel(volt):
+    '''Coded string of a voltage, integer part 0..255 and hundredths'''
+    val = min(max(round(volt * 100), 0), 25599)
+    return bytostr(val // 100) + bytostr(val % 100)
+
+def decode_telemetry(data):
+    '''Decodes the binary telemetry telegram of a receiver into a dict, 
+    None if the telegram is not valid
+    '''
+    if (len(data) < TM_HDR.size) or (data[1] < 1):
+        return None
+    (magic, version, rx_id, state, accepted, lost, stale, errors, failsafe,
+     link, level, noise, nain) = TM_HDR.unpack_from(data)
+    if (len(data) < TM_HDR.size + nain * TM_AIN.size):
+        return None
+    ain = {}
+    for k in range(nain):
+        ch, val = TM_AIN.unpack_from(data, TM_HDR.size + k * TM_AIN.size)
+        ain[ch] = val / 100
+    return {'rx_id': rx_id, 'state': state, 'accepted': accepted, 
+            'lost': lost, 'stale': stale, 'errors': errors, 
+            'failsafe': failsafe, 'link': link, 'level': level, 
+            'noise': noise, 'ain': ain, 'time': time()}
+
 def Observer_loop():
     # communication data via queue -  V_Sensor and State of communication
     print('Observer Loop running')
     observer_dat = [RED, "0000"]
     t_rec_tel_rc = time()  
-    Tel_ID, ip = range(2)
-    QuetoUDP = [0, ""]           
+    Tel_ID, ip, version, rx_id = range(4)
+    QuetoUDP = [0, "", 1, 0]           
     while True: 
         data, address = sock.recvfrom(1024)
-        data = data.decode('utf-8')
+        if data and (data[0] == TM_MAGIC):
+            tm = decode_telemetry(data)
+            if tm is not None:
+                rx_telemetry[tm['rx_id']] = tm
+                if (tm['state'] & TM_FAILSAFE):
+                    observer_dat[0] = YELLOW
+                else:
+                    observer_dat[0] = GREEN
+                if tm['ain']:
+                    observer_dat[1] = voltotel(tm['ain'][min(tm['ain'])])
+                t_rec_tel_rc = time()
+            data = b""
+        data = data.decode('utf-8', 'replace')
         #print (data)
         if (data):
             # Rx_BC received ?
             if (strtobyte(data[1:3]) == 1):
-                observer_dat[0] = GREEN 
+                # the fail safe state is known by the telemetry only
+                if (observer_dat[0] == RED):
+                    observer_dat[0] = GREEN 
                 observer_dat[1] = data[11:15]
                 QuetoUDP[Tel_ID] = 1
                 QuetoUDP[ip] = address[0] 
+                # receivers without version field understand version 1 only
+                QuetoUDP[version] = max(strtobyte(data[15:17]), 1)
+                # receivers without ID field => ID 0
+                QuetoUDP[rx_id] = max(strtobyte(data[17:19]), 0)
                 t_rec_tel_rc = time()
                     
             # Screen broadcast ?
@@ -302,63 +490,95 @@ def Observer_loop():
                 
             if not q_obs_to_Udp_loop.full():
                 #print("QuetoUDP", QuetoUDP)
-                q_obs_to_Udp_loop.put(QuetoUDP, block=False)   
+                q_obs_to_Udp_loop.put(list(QuetoUDP), block=False)   
         
         tout = (time() - t_rec_tel_rc)
         if (tout > 3.0):
             observer_dat[0] = RED
         if not q_observer.full(): 
-                q_observer.put(observer_dat, block=False)                      
-        sleep(0.5)      
+                q_observer.put(list(observer_dat), block=False)                      
+
+def curve(x, dz, expo, epl, eph):
+    '''Output -1..1 of the stick position x -1..1, parameters in %'''
+    dz = dz / 100
+    if (abs(x) <= dz):
+        return 0.0
+    y = (abs(x) - dz) / (1 - dz)
+    y = (1 - expo / 100) * y + expo / 100 * y ** 3
+    if (x < 0):
+        return -y * epl / 100
+    return y * eph / 100
+
+def curve_tab(event, rate):
+    '''Value table 0..254 of all GP outputs MIN..MAX of the event, 
+    rate = dual rate in %
+    '''
+    conf = GPcfg.analogEvent[event]
+    params = list(conf[DZ:]) + list(CURVE_DEFAULT[len(conf[DZ:]):])
+    irange = abs(conf[MIN]) + conf[MAX]
+    half = (irange - 1) / 2
+    tab = []
+    for i in range(irange + 1):
+        x = (max(i - 1, 0) - half) / half
+        if conf[IV]:
+            x = -x
+        y = curve(x, *params) * rate / 100
+        tab.append(min(254, max(0, CENTER + round(CENTER * y))))
+    return tab
+
+def select_tab(event):
+    '''Switches the table of the event according to its dual rate state'''
+    if GPcfg.analogEvent[event][DR]:
+        val_tab[event] = dict_ValCorrDR[event]
+    else:
+        val_tab[event] = dict_ValCorr[event]
 
 def create_ValCorr(): 
     ''' Creates tables for each event that results from the GP range output
-    to a range of 0..254
+    to a range of 0..254, the curves are compiled once, the loops only index
+    the tables 
     ''' 
-    global dict_ValCorr
     for event in GPcfg.analogEvent:
-        irange = abs(GPcfg.analogEvent[event][MIN]) \
-                     + GPcfg.analogEvent[event][MAX]
-        if GPcfg.analogEvent[event][IV]:
-            tab = []  
-            tab.append(254)
-            for i in range (irange): 
-                tab.append(irange - (i+1))            
-            dict_ValCorr[event] = tab
-        else:
-            tab = []
-            tab.append(0) 
-            for i in range (irange): 
-                tab.append(i) 
-            dict_ValCorr[event] = tab
+        dict_ValCorr[event] = curve_tab(event, 100)
+        dict_ValCorrDR[event] = curve_tab(event, GPcfg.DualRate)
+        select_tab(event)
+        # center position until the first event
+        in_idx[event] = len(dict_ValCorr[event]) // 2
 
-gamepad = InputDevice(GPcfg.USB_event)
+# opened by main(), any object with a read_loop() like evdev.InputDevice
+gamepad = None
 
 def GP_loop(): 
     print('GP_loop running')
     #sleep(3)
     for event in gamepad.read_loop():
         if (event.code in GPcfg.analogEvent):            
-            if (not q_aloop.full()):               
-                q_aloop.put((event.code, event.value), block=False)
-                #print ('put_q', event.code, event.value) 
-            else: 
-                print('q_aloop full')
+            flightrec.event(event)
+            # latest position only, read by the UDP_run
+            ev = GPcfg.analogEvent[event.code]
+            in_idx[event.code] = event.value - ev[MIN]
+            tx_event.set()
         elif (event.code in GPcfg.eventlist):
+            flightrec.event(event)
             if (not q_eloop.full()):
                 #print (event.code, event.value)
                 q_eloop.put((event.code, event.value), block=False)
+                tx_event.set()
             else: 
                print('q_eloop full')
 
      
 def main():  
-    sleep(5) 
-    while (get_ip_address(GPcfg.ifname) == "127.0.0.0"):
-         print ("waiting for networking")
-         sleep(1)      
-    #print(gamepad.capabilities())   
+    global gamepad
     create_ValCorr()  
+    if GPcfg.REC_FILE:
+        flightrec.open_file(GPcfg.REC_FILE, GPcfg.REC_SIZE)
+    # the gamepad and the network are waited for without a fixed delay
+    while not path.exists(GPcfg.USB_event):
+        sleep(0.1)
+    gamepad = InputDevice(GPcfg.USB_event)
+    #print(gamepad.capabilities())   
+    netstate.wait_for_address(GPcfg.ifname)
     Thread(target = GP_loop).start()
     Thread(target = Observer_loop).start()
     UDP_run()
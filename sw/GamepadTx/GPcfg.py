@@ -39,7 +39,9 @@ else:
     # event number has to be configured
     USB_event = '/dev/input/event10'
   
-# {eventcode : [channel, invert, dual rate ],....}
+# {eventcode : [channel, invert, dual rate, min, max 
+#               [, deadzone, expo, endpoint low, endpoint high]],....}
+# curve parameters in %, default 0, 0, 100, 100 (linear) 
 analogEvent = {1 : [0, True, False, -128, 127], 
                5 : [3, False, False, -128, 127]}
 # {eventcode : (channel, increment),....}
@@ -56,6 +58,23 @@ shutdEvent = 312
 eventlist = (304, 305, 306, 307, 308, 310, 312)    
 minAnaVal = -128
 DualRate  = 70 
+# send mode: False => all channels every 30 ms 
+# True => changed channels immediately on each input event and all channels
+# every KEEPALIVE s (below the link loss timeout of the receiver)
+DELTA = False
+KEEPALIVE = 0.1
+# {receiver ID (rccfg.RX_ID of the receiver) : (channels),....}
+# The receivers are found by their Rx_BC telegrams, each one gets the 
+# channels of its set by unicast. Empty => broadcast of all channels to 
+# every receiver on the network
+receivers = {}
+#receivers = {1 : (0, 3), 
+#             2 : (0, 3)}      # two models driven by the same sticks
+# flight recorder of the gamepad events and the sent telegrams, ring file
+# with the last REC_SIZE bytes, list: python3 flightrec.py FILE,
+# replay: tools/replay.py FILE.  '' => off
+REC_FILE = '/var/tmp/rcpi/gpapp.rec'
+REC_SIZE = 4 * 1024 * 1024
     
 
 def searchGP():
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        Flight recorder of the Gamepad Transmitter
+# Purpose:     Records the gamepad events and the sent telegrams with time
+#              stamps into a memory mapped ring file of fixed size, the
+#              oldest records are overwritten
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+# File layout (big endian):
+#   header  magic 'RCFR', version, size of the data area, head (next write
+#           offset), tail (oldest record), records in the file, records
+#           written since the file was created
+#   data    records: kind, payload length, time (s since the epoch), payload
+#           kind WRAP (one byte) marks the unused end of the data area
+import os
+import sys
+import mmap
+import socket
+import struct
+from time import time
+from threading import Lock
+
+REC_MAGIC = b'RCFR'
+REC_VERSION = 1
+HDR = struct.Struct('>4sHHIIIIQ')
+REC = struct.Struct('>BHd')
+HDR_SIZE = 64
+# record kinds
+WRAP, EVENT, TEL = range(3)
+EV = struct.Struct('>HHi')        # evdev type, code, value
+KIND_NAMES = {EVENT: 'event', TEL: 'tel'}
+
+mm = None          # mapped file, None => recorder off
+size = 0           # size of the data area
+head = 0
+tail = 0
+nrec = 0
+total = 0
+lock = Lock()
+
+def open_file(path, data_size):
+    '''Opens or creates the ring file, a file with another size or format is
+    created new. Returns False if the file is not usable (recorder off)
+    '''
+    global mm, size, head, tail, nrec, total
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if (os.fstat(fd).st_size != HDR_SIZE + data_size):
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, HDR_SIZE + data_size)
+            mm = mmap.mmap(fd, HDR_SIZE + data_size)
+        finally:
+            os.close(fd)
+    except OSError as exc:
+        print ("Flight recorder off: " + repr(exc))
+        mm = None
+        return False
+    size = data_size
+    magic, vers, _, fsize, head, tail, nrec, total = HDR.unpack_from(mm, 0)
+    if ((magic != REC_MAGIC) or (vers != REC_VERSION) or (fsize != size)
+            or (head > size) or (tail > size)):
+        head = tail = nrec = total = 0
+        write_header()
+    return True
+
+def write_header():
+    HDR.pack_into(mm, 0, REC_MAGIC, REC_VERSION, 0, size, head, tail, nrec,
+                  total)
+
+def close():
+    global mm
+    with lock:
+        if mm is not None:
+            mm.flush()
+            mm.close()
+            mm = None
+
+def _free(end):
+    '''Drops the oldest records within head..end'''
+    global tail, nrec
+    while nrec and (head <= tail < end):
+        if (tail + REC.size > size) or (mm[HDR_SIZE + tail] == WRAP):
+            tail = 0
+        else:
+            tail += REC.size + REC.unpack_from(mm, HDR_SIZE + tail)[1]
+            nrec -= 1
+            if (tail >= size):
+                tail = 0
+    if not nrec:
+        tail = head
+
+def append(kind, payload, t=None):
+    '''Appends a record, the oldest records are overwritten'''
+    global head, tail, nrec, total
+    if mm is None:
+        return
+    n = REC.size + len(payload)
+    if (n > size):
+        return
+    with lock:
+        if mm is None:
+            return
+        if (head + n > size):
+            _free(size)
+            if (head < size):
+                mm[HDR_SIZE + head] = WRAP
+            head = 0
+            if not nrec:
+                tail = 0
+        _free(head + n)
+        off = HDR_SIZE + head
+        REC.pack_into(mm, off, kind, len(payload), time() if t is None else t)
+        mm[off + REC.size:off + n] = payload
+        head += n
+        nrec += 1
+        total += 1
+        write_header()
+
+def event(ev):
+    '''Records an evdev input event'''
+    if mm is not None:
+        append(EVENT, EV.pack(ev.type, ev.code, ev.value))
+
+def telegram(tel, ip):
+    '''Records a sent telegram (bytes) with the destination address'''
+    if mm is not None:
+        try:
+            addr = socket.inet_aton(ip)
+        except OSError:
+            addr = bytes(4)
+        append(TEL, addr + tel)
+
+def read(path):
+    '''Returns the records of a ring file, oldest first, as a list of
+    (time, kind, payload) with payload (type, code, value) for EVENT and
+    (destination ip, telegram) for TEL
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, vers, _, fsize, fhead, ftail, fnrec, _ = HDR.unpack_from(data, 0)
+    if (magic != REC_MAGIC) or (vers != REC_VERSION):
+        raise ValueError(path + " is not a flight recorder file")
+    recs = []
+    pos = ftail
+    for i in range(fnrec):
+        if (pos + REC.size > fsize) or (data[HDR_SIZE + pos] == WRAP):
+            pos = 0
+        kind, length, t = REC.unpack_from(data, HDR_SIZE + pos)
+        off = HDR_SIZE + pos + REC.size
+        payload = data[off:off + length]
+        if (kind == EVENT):
+            payload = EV.unpack(payload)
+        elif (kind == TEL):
+            payload = (socket.inet_ntoa(payload[:4]), payload[4:])
+        recs.append((t, kind, payload))
+        pos += REC.size + length
+    return recs
+
+def main():
+    ''' python3 flightrec.py FILE, lists the records'''
+    recs = read(sys.argv[1])
+    t0 = recs[0][0] if recs else 0.0
+    for t, kind, payload in recs:
+        print ("%10.4f" % (t - t0), KIND_NAMES.get(kind, kind), payload)
+
+if __name__ == '__main__':
+    main()
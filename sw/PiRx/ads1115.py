@@ -11,7 +11,10 @@
 # Licence:     MIT see https://opensource.org/licenses/MIT
 # -------------------------------------------------------------------------------
 import time
-from pca9685 import bus
+import rccfg
+# requests of the ADS1115 are executed by the owner of the bus with low
+# priority, the servo frames are not delayed by the sampler 
+from pca9685 import adc_bus as bus
 
 ADS_ADDRESS = 0x48  # address pin is connected with GND
 REG_CONV = 0x00
@@ -87,10 +90,113 @@ def init():
     set_cfg(0)
     print (hex(read_adc()))
 
+# ---------- round robin sampler ---------------------------------------------
+# The Sampler_loop converts the inputs of rccfg.ADS_CHANNELS one after the 
+# other in single shot mode and stores each sample in the ring buffer of the
+# input. Readers get the filtered values without any bus access.
+READY_POLL = 0.0002   # s between two polls of the conversion ready bit
+chans = rccfg.ADS_CHANNELS
+ring = {}      # input: the last rccfg.ADS_RING samples (raw), preallocated
+pos = {}       # input: next index of the ring
+fill = {}      # input: count of valid samples within the ring
+rsum = {}      # input: running sum of the ring
+filt = {}      # input: low pass filtered value in V
+for ch in chans:
+    ring[ch] = [0] * rccfg.ADS_RING
+    pos[ch] = 0
+    fill[ch] = 0
+    rsum[ch] = 0
+    filt[ch] = None
+ads_stat = {'samples': 0, 'not_ready': 0, 'errors': 0}
+
+def start_conversion(channel, samples_per_second=rccfg.ADS_SPS):
+    '''Starts a single shot conversion of the input'''
+    config = (ADS_CONF_OS_SINGLE | CHANNEL[channel] | ADS1X15_GAIN[GAIN] |
+              SINGLE | ADS1115_SAMPLE[samples_per_second] | 0x0003)
+    bus.write_i2c_block_data(ADS_ADDRESS, REG_CFG, 
+                             [(config >> 8) & 0xFF, config & 0xFF])
+
+def conversion_ready():
+    '''The OS bit is set again when the single shot conversion is done'''
+    return (read_cfg() & ADS_CONF_OS_SINGLE) != 0
+
+def sample(channel, samples_per_second=rccfg.ADS_SPS):
+    '''Converts the input and returns the signed raw value'''
+    start_conversion(channel, samples_per_second)
+    time.sleep(1.0 / samples_per_second)
+    tries = 10
+    while not conversion_ready():
+        ads_stat['not_ready'] += 1
+        tries -= 1
+        if (tries == 0):
+            raise OSError("ADS1115 conversion not ready")
+        time.sleep(READY_POLL)
+    val = read_adc()
+    if (val >= 0x8000):
+        val -= 0x10000
+    return val
+
+def store(channel, val):
+    '''Adds a raw sample to the ring and to the filtered value'''
+    r = ring[channel]
+    i = pos[channel]
+    rsum[channel] += val - r[i]
+    r[i] = val
+    pos[channel] = (i + 1) % len(r)
+    if (fill[channel] < len(r)):
+        fill[channel] += 1
+    volt = convert_to_V(val, rccfg.ADS_DIVIDER.get(channel, 1.0))
+    if filt[channel] is None:
+        filt[channel] = volt
+    else:
+        filt[channel] += rccfg.ADS_FILT * (volt - filt[channel])
+    ads_stat['samples'] += 1
+
+def value(channel):
+    '''Latest filtered value of the input in V, None before the first sample'''
+    return filt[channel]
+
+def minmeanmax(channel):
+    '''(min, mean, max) in V of the samples within the ring'''
+    n = fill[channel]
+    if (n == 0):
+        return None
+    r = ring[channel]
+    if (n < len(r)):
+        r = r[:n]
+    div = rccfg.ADS_DIVIDER.get(channel, 1.0)
+    return (convert_to_V(min(r), div), 
+            convert_to_V(rsum[channel] / n, div), 
+            convert_to_V(max(r), div))
+
+def statistics():
+    '''Values of all inputs for the metrics export'''
+    res = dict(ads_stat)
+    for ch in chans:
+        mmm = minmeanmax(ch)
+        if mmm is not None:
+            res['ain%d' % ch] = filt[ch]
+            res['ain%d_min' % ch], res['ain%d_mean' % ch], \
+                res['ain%d_max' % ch] = mmm
+    return res
+
+def Sampler_loop():
+    print ("ADS1115 sampler running")
+    while True:
+        for ch in chans:
+            try:
+                store(ch, sample(ch))
+            except OSError as exc:
+                ads_stat['errors'] += 1
+                print ("ADS1115 failed: " + repr(exc))
+                time.sleep(1.0)
+
 def main():    
     init()
     while True: 
-        print (convert_to_V(read_adc(), 5.69), "V")
+        for ch in chans:
+            store(ch, sample(ch))
+            print (ch, value(ch), "V")
         time.sleep(1)
 
 if __name__ == '__main__':
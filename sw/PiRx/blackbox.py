@@ -0,0 +1,205 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        Black box of the Remote Control Receiver
+# Purpose:     Keeps the last received telegrams, channel values, fail safe
+#              transitions and register writes in a preallocated ring of
+#              fixed size slots, written to a memory mapped file on fail safe,
+#              exception and shutdown
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+# Slot (64 bytes, big endian): time, kind, a, b, data (52 bytes)
+#   TEL   received telegram     a = 0, b = length, data = first 52 bytes
+#   VAL   channel values        a = count, data = value of each channel
+#   FS    fail safe             a = 1 entered, 0 left
+#   REG   register write        a = device, b = register << 8 | count
+#   EXC   exception             b = length, data = description
+#   CMD   command record        a = channel, b = value
+# File: header (magic 'RCBB', version, slot size, slots, next slot, records
+# written, time of the flush, reason) followed by the slots
+import sys
+import mmap
+import os
+import struct
+import threading
+from time import time
+import rccfg
+
+# The callers check ENABLED before recording, the recording writes into the
+# preallocated ring only (no objects are kept per telegram).
+ENABLED = bool(rccfg.BB_FILE)
+
+BB_MAGIC = b'RCBB'
+BB_VERSION = 1
+SLOT = struct.Struct('>dBBH52s')
+SLOT_HDR = 12                      # offset of the data within the slot
+HDR = struct.Struct('>4sHHIIQd16s')
+HDR_SIZE = 64
+TEL, VAL, FS, REG, EXC, CMD = range(1, 7)
+KIND_NAMES = {TEL: 'tel', VAL: 'val', FS: 'failsafe', REG: 'reg',
+              EXC: 'exception', CMD: 'cmd'}
+
+nslots = rccfg.BB_SLOTS
+ring = bytearray(SLOT.size * nslots)
+pos = 0            # next slot
+cnt = 0            # records written
+lock = threading.Lock()
+mm = None          # mapped file, None => in memory only
+flush_event = threading.Event()
+flush_reason = b''
+
+def record(kind, a=0, b=0, data=b''):
+    '''Writes a record into the next slot (data is truncated to 52 bytes)'''
+    global pos, cnt
+    with lock:
+        SLOT.pack_into(ring, pos * SLOT.size, time(), kind, a, b, data)
+        pos += 1
+        if (pos == nslots):
+            pos = 0
+        cnt += 1
+
+def telegram(data):
+    record(TEL, 0, len(data), data)
+
+def values(plan):
+    '''Records the last value of each channel of the plan'''
+    global pos, cnt
+    with lock:
+        off = pos * SLOT.size
+        n = min(len(plan), 52)
+        SLOT.pack_into(ring, off, time(), VAL, n, 0, b'')
+        off += SLOT_HDR
+        for i in range(n):
+            ring[off + i] = plan[i].last
+        pos += 1
+        if (pos == nslots):
+            pos = 0
+        cnt += 1
+
+def reg_write(dev, reg, data):
+    '''Records a block write of the pca9685 driver (max. 32 bytes)'''
+    global pos, cnt
+    with lock:
+        off = pos * SLOT.size
+        n = min(len(data), 52)
+        SLOT.pack_into(ring, off, time(), REG, dev, (reg << 8) | n, b'')
+        off += SLOT_HDR
+        for i in range(n):
+            ring[off + i] = data[i]
+        pos += 1
+        if (pos == nslots):
+            pos = 0
+        cnt += 1
+
+def failsafe(active):
+    record(FS, 1 if active else 0)
+    if active:
+        request_flush(b'failsafe')
+
+def command(chan, telval):
+    record(CMD, chan, telval)
+
+def exception(exc):
+    '''Records an exception, the file is written by the flush thread so a
+    stream of invalid datagrams does not delay the receiver
+    '''
+    text = repr(exc).encode('utf-8', 'replace')
+    record(EXC, 0, len(text), text)
+    request_flush(b'exception')
+
+def init():
+    '''Maps the file, starts the flush thread and records uncaught
+    exceptions of all threads
+    '''
+    global mm
+    path = rccfg.BB_FILE
+    size = HDR_SIZE + len(ring)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if (os.fstat(fd).st_size != size):
+                os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+    except OSError as exc:
+        print ("Black box in memory only: " + repr(exc))
+    threading.Thread(target = Flush_loop, daemon = True).start()
+    sys_hook = sys.excepthook
+    thread_hook = threading.excepthook
+    # uncaught exceptions end the thread or the program, written immediately
+    def sys_exception(typ, val, tb):
+        exception(val)
+        flush(b'exception')
+        sys_hook(typ, val, tb)
+    def thread_exception(args):
+        exception(args.exc_value)
+        flush(b'exception')
+        thread_hook(args)
+    sys.excepthook = sys_exception
+    threading.excepthook = thread_exception
+
+def flush(reason):
+    '''Writes the ring to the file, the previous content is replaced'''
+    if mm is None:
+        return
+    with lock:
+        mm[HDR_SIZE:] = ring
+        HDR.pack_into(mm, 0, BB_MAGIC, BB_VERSION, SLOT.size, nslots, pos,
+                      cnt, time(), reason)
+    mm.flush()
+
+def request_flush(reason):
+    '''Flush by the flush thread, the caller is not delayed'''
+    global flush_reason
+    flush_reason = reason
+    flush_event.set()
+
+def Flush_loop():
+    while True:
+        flush_event.wait()
+        flush_event.clear()
+        flush(flush_reason)
+
+def read(path):
+    '''Returns (header dict, records oldest first) of a black box file,
+    records as (time, kind name, a, b, data)
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, vers, slot, n, fpos, fcnt, tflush, reason = HDR.unpack_from(data)
+    if (magic != BB_MAGIC) or (vers != BB_VERSION) or (slot != SLOT.size):
+        raise ValueError(path + " is not a black box file")
+    hdr = {'records': fcnt, 'flushed': tflush,
+           'reason': reason.rstrip(b'\0').decode()}
+    recs = []
+    first = fpos if (fcnt > n) else 0
+    for i in range(min(fcnt, n)):
+        off = HDR_SIZE + ((first + i) % n) * slot
+        t, kind, a, b, body = SLOT.unpack_from(data, off)
+        if kind in (TEL, EXC):
+            body = body[:b]
+        elif (kind == VAL):
+            body = list(body[:a])
+        elif (kind == REG):
+            body = list(body[:b & 0xFF])
+            b >>= 8
+        else:
+            body = b''
+        recs.append((t, KIND_NAMES.get(kind, kind), a, b, body))
+    return hdr, recs
+
+def main():
+    ''' python3 blackbox.py [FILE], lists the records'''
+    hdr, recs = read(sys.argv[1] if (len(sys.argv) > 1) else rccfg.BB_FILE)
+    print (hdr)
+    for t, kind, a, b, body in recs:
+        print ("%8.4f" % (t - hdr['flushed']), kind, a, b, body)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        Channel plan of the Remote Control Receiver
+# Purpose:     Compiles the channel configuration of a model (rccfg.models)
+#              into channel objects with pre-bound output handlers,
+#              invalid configurations are rejected
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+import os
+import marshal
+import hashlib
+from functools import lru_cache
+import pca9685 as PWM
+import rccfg
+
+TRIM_CENTER = 25   # trim position 0..50 without trim adjustment
+# mode of the direction pins IN1, IN2 of a L298 channel, driven by the
+# L298 channel only
+L298_IN = -1
+
+def trim_center(center, trimm):
+    '''Servo center puls duration for a trim position 0..50'''
+    return round(((center * (trimm - 25)/254) + center),3)
+
+# impulse tables {(center, rate, reverse, trimm) : table}, loaded from the
+# cache file of the configuration (rccfg.TAB_CACHE) if available
+tab_cache = {}
+
+def servo_tab(center, rate, reverse, trimm):
+    """Impulse table (0..4095) of a servo channel for a trim position.
+    The tables are immutable and shared by all channels with the same
+    configuration, so trimming is a table swap.
+    """
+    key = (center, rate, reverse, trimm)
+    tab = tab_cache.get(key)
+    if tab is None:
+        tab = calc_servo_tab(center, rate, reverse, trimm)
+        tab_cache[key] = tab
+    return tab
+
+def calc_servo_tab(center, rate, reverse, trimm):
+    if reverse:
+        trimm = 50 - trimm
+    ctr = trim_center(center, trimm)
+    r2 = 2 * rate
+    k = rccfg.FREQ / 1000
+    maxi = PWM.MAX_I_P9685
+    if reverse:
+        vals = range(254, -1, -1)
+    else:
+        vals = range(255)
+    return tuple([int(round((r2 * v / 254.0 + ctr - rate) * k * maxi, 0))
+                  for v in vals])
+
+@lru_cache(maxsize=1)
+def l298_tab():
+    '''Duty cycle (0..4065) of the enable pin of a L298 channel'''
+    return tuple([round(abs(i - 127) * 32.008) for i in range(255)])
+
+class Channel():
+    """Configuration and output state of one logical channel
+
+    update(telval) = output with filter, output(telval) = without filter,
+    both are bound to the handler of the mode when the plan is compiled
+    """
+    __slots__ = ('chan', 'mode', 'center', 'rate', 'reverse', 'accfilt',
+                 'failsafe', 'stepw', 'fsmode', 'fsrate', 'conf', 'center_tr',
+                 'trimm', 'tab', 'last', 'update', 'output')
+
+    def __init__(self, mode, chan, center=1.5, rate=0.5, reverse=False,
+                 accfilt=False, failsafe=127, stepw=127, fsmode=rccfg.JUMP,
+                 fsrate=0):
+        self.chan = chan
+        self.mode = mode
+        self.center = center
+        self.rate = rate
+        self.reverse = reverse
+        self.accfilt = accfilt
+        self.failsafe = failsafe
+        self.stepw = stepw
+        self.fsmode = fsmode
+        self.fsrate = fsrate
+        # all configuration values, channels with equal conf are identical
+        self.conf = (mode, chan, center, rate, reverse, accfilt, failsafe,
+                     stepw, fsmode, fsrate)
+        self.center_tr = center
+        self.trimm = TRIM_CENTER
+        self.last = failsafe     # last value, input of the filter
+        if (mode == rccfg.SERVO):
+            self.tab = servo_tab(center, rate, reverse, TRIM_CENTER)
+            self.output = self.servo
+        elif (mode == rccfg.DIO):
+            self.tab = None
+            self.output = self.dio
+        elif (mode == rccfg.L298):
+            self.tab = l298_tab()
+            self.output = self.l298
+        else:
+            self.tab = None
+            self.output = self.pin
+        if accfilt and (mode != L298_IN):
+            self.update = self.filtered
+        elif (mode == rccfg.SERVO):
+            self.update = self.servo_direct
+        else:
+            self.update = self.direct
+
+    # ---------- handlers ----------------------------------------------------
+    def servo(self, telval):
+        PWM.frame_pwm(self.chan, 0, self.tab[telval])
+
+    def servo_direct(self, telval):
+        self.last = telval
+        PWM.frame_pwm(self.chan, 0, self.tab[telval])
+
+    def dio(self, telval):
+        PWM.frame_dio(self.chan, telval)
+
+    def l298(self, telval):
+        """Enable pin with the duty cycle, IN1 and IN2 with the direction"""
+        chan = self.chan
+        PWM.frame_pwm(chan, 0, self.tab[telval])
+        if (telval < 127):
+            PWM.frame_dio(chan + 1, 0)
+            PWM.frame_dio(chan + 2, 1)
+        elif (telval > 127):
+            PWM.frame_dio(chan + 1, 1)
+            PWM.frame_dio(chan + 2, 0)
+        else:
+            PWM.frame_dio(chan + 1, 0)
+            PWM.frame_dio(chan + 2, 0)
+
+    def pin(self, telval):
+        pass
+
+    def direct(self, telval):
+        self.last = telval
+        self.output(telval)
+
+    def filtered(self, inp):
+        """Decreases the input rise rate, the value moves by max. STEPW
+        when moving away from the fail safe value
+        """
+        an = self.last
+        da = self.stepw
+        if ((inp > self.failsafe) and (inp > (an + da))):
+            cout = an + da
+        elif ((inp < self.failsafe) and (inp < (an - da))):
+            cout = an - da
+        else:
+            cout = inp
+        self.last = min(max(cout, 0), 254)
+        self.output(self.last)
+
+    def trim(self, trimm):
+        """Trim position 0..50 of a servo channel, the table is swapped"""
+        if (self.mode != rccfg.SERVO):
+            return
+        self.trimm = trimm
+        self.tab = servo_tab(self.center, self.rate, self.reverse, trimm)
+        if self.reverse:
+            trimm = 50 - trimm
+        self.center_tr = trim_center(self.center, trimm)
+
+def _check(ok, entry, text):
+    if not ok:
+        raise ValueError("channel configuration " + repr(entry) + ": " + text)
+
+def validate(entry):
+    '''Checks the values of one channel configuration'''
+    _check(8 <= len(entry) <= 10, entry, "8 to 10 values expected")
+    mode, chan, center, rate, reverse, accfilt, failsafe, stepw = entry[:8]
+    fsmode = entry[8] if (len(entry) > 8) else rccfg.JUMP
+    fsrate = entry[9] if (len(entry) > 9) else 0
+    _check(mode in (rccfg.SERVO, rccfg.DIO, rccfg.L298), entry,
+           "unknown MODE")
+    _check(isinstance(chan, int) and (0 <= chan < PWM.NCHAN), entry,
+           "CHANNEL out of range 0.." + str(PWM.NCHAN - 1))
+    if (mode == rccfg.L298):
+        _check(chan + 2 < PWM.NCHAN, entry,
+               "IN1, IN2 (CHANNEL + 1, + 2) out of range")
+    if (mode == rccfg.SERVO):
+        _check(0 < rate < center, entry, "RATE out of range 0..CENTER")
+        _check(center + rate < 1000 / rccfg.FREQ, entry,
+               "CENTER + RATE exceeds the PWM period")
+    _check(isinstance(failsafe, int) and (0 <= failsafe <= 254), entry,
+           "FAILSAFE out of range 0..254")
+    _check(0 < stepw <= 255, entry, "STEPW out of range 1..255")
+    _check(fsmode in (rccfg.HOLD, rccfg.JUMP, rccfg.RAMP), entry,
+           "unknown FSMODE")
+    _check(fsrate >= 0, entry, "FSRATE negative")
+    if (fsmode == rccfg.RAMP):
+        _check(fsrate > 0, entry, "FSRATE required for FSMODE RAMP")
+
+def cache_file(entries):
+    '''Cache file of the tables, the name is the hash of the configuration'''
+    key = repr((sorted(entries), rccfg.FREQ, PWM.MAX_I_P9685))
+    return os.path.join(rccfg.TAB_CACHE,
+                        hashlib.sha1(key.encode()).hexdigest() + '.tab')
+
+def load_tabs(entries):
+    '''Loads the impulse tables of the configuration from the cache,
+    returns False if there is no valid cache file
+    '''
+    try:
+        with open(cache_file(entries), 'rb') as f:
+            tab_cache.update(marshal.load(f))
+    except (OSError, EOFError, ValueError, TypeError):
+        return False
+    return True
+
+def save_tabs(entries):
+    '''Writes the impulse tables of the configuration to the cache'''
+    keys = set()
+    for entry in entries:
+        if (entry[0] == rccfg.SERVO):
+            for trimm in range(51):
+                keys.add((entry[2], entry[3], entry[4], trimm))
+    path = cache_file(entries)
+    try:
+        os.makedirs(rccfg.TAB_CACHE, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            marshal.dump({k: tab_cache[k] for k in keys}, f)
+        os.replace(path + '.tmp', path)
+    except OSError as exc:
+        print ("Table cache not written: " + repr(exc))
+
+def compile_plan(entries):
+    '''Returns the channel plan (tuple of NCHAN channels) of a model
+    configuration, raises ValueError for an invalid configuration
+    '''
+    owner = {}     # channel: configuration using it
+    for entry in entries:
+        validate(entry)
+        mode, chan = entry[:2]
+        used = [chan]
+        if (mode == rccfg.L298):
+            used += [chan + 1, chan + 2]
+        for c in used:
+            _check(c not in owner, entry, "channel " + str(c) +
+                   " is already used by " + repr(owner.get(c)))
+            owner[c] = entry
+    cached = rccfg.TAB_CACHE and load_tabs(entries)
+    plan = [Channel(rccfg.SERVO, c) for c in range(PWM.NCHAN)]
+    for entry in entries:
+        ch = Channel(*entry)
+        plan[ch.chan] = ch
+        if (ch.mode == rccfg.SERVO):
+            # all trim positions are precomputed
+            for trimm in range(51):
+                servo_tab(ch.center, ch.rate, ch.reverse, trimm)
+        if (ch.mode == rccfg.L298):
+            plan[ch.chan + 1] = Channel(L298_IN, ch.chan + 1, failsafe=0)
+            plan[ch.chan + 2] = Channel(L298_IN, ch.chan + 2, failsafe=0)
+    if rccfg.TAB_CACHE and not cached:
+        save_tabs(entries)
+    return tuple(plan)
+
+def main():
+    '''Checks all models of rccfg'''
+    for name in rccfg.models:
+        try:
+            compile_plan(rccfg.models[name])
+            print (name, "ok")
+        except ValueError as exc:
+            print (name, exc)
+
+if __name__ == '__main__':
+    main()
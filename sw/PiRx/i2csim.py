@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        I2C bus simulator
+# Purpose:     Simulated SMBus for the SIM mode, models the register files of
+#              the PCA9685 and the ADS1115 and the time cost of the bus
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+import sys
+from time import perf_counter, sleep
+from math import sin, pi
+import rccfg
+
+PCA_ADDR = 0x40
+ADS_ADDR = 0x48
+# PCA9685 registers
+MODE1, MODE2, PRESCALE, LED0_ON_L, ALL_LED_ON_L = 0x00, 0x01, 0xFE, 0x06, 0xFA
+AI = 0x20
+# ADS1115 registers and config bits
+REG_CONV, REG_CFG = 0x00, 0x01
+OS = 0x8000
+SINGLE = 0x0100
+ADS_RATE = (8, 16, 32, 64, 128, 250, 475, 860)
+ADS_FSR = (6.144, 4.096, 2.048, 1.024, 0.512, 0.256, 0.256, 0.256)
+
+# Transaction log entries
+# (start time, kind, device, register, count of data bytes, cost in s)
+T_START, T_KIND, T_DEV, T_REG, T_CNT, T_COST = range(6)
+WRITE, READ = range(2)
+
+class SimBus():
+    """SMBus replacement with the interface used by pca9685 and ads1115
+
+    hz = bus clock, every byte costs 9 clocks, start/stop 1 clock each
+    t_trans = fixed cost of a transaction (driver, ioctl) in s
+    realtime = each transaction blocks for its cost like the real bus
+    """
+    def __init__(self, hz=rccfg.SIM_I2C_HZ, t_trans=rccfg.SIM_T_TRANS,
+                 realtime=False):
+        self.hz = hz
+        self.t_trans = t_trans
+        self.realtime = realtime
+        self.pca = {}                # PCA9685 register files by address
+        self.ain = [0.0] * 4         # ADS1115 input voltages AIN0..AIN3
+        self.ads_cfg = 0x8583        # power on default
+        self.ads_conv = 0
+        self.ads_ready = 0.0         # time the running conversion is done
+        self.listener = None         # callback(dev, reg, data) after writes
+        self.reset()
+
+    def add_pca(self, addr=PCA_ADDR):
+        """Connects a PCA9685 board with the address to the bus"""
+        self.pca[addr] = self.pca_reset()
+
+    def pca_reset(self):
+        regs = bytearray(256)
+        regs[MODE1] = 0x11
+        regs[MODE2] = 0x04
+        regs[PRESCALE] = 0x1E
+        for chnl in range(16):
+            regs[LED0_ON_L + 4 * chnl + 3] = 0x10    # full off
+        return regs
+
+    def reset(self):
+        '''Clears the transaction log and the statistics'''
+        self.log = []
+        self.busy = 0.0
+        self.t0 = perf_counter()
+
+    def cost(self, kind, cnt):
+        '''Time of a transaction with cnt data bytes'''
+        if (kind == WRITE):
+            clocks = (2 + cnt) * 9 + 2     # address, register, data
+        else:
+            clocks = (3 + cnt) * 9 + 3     # repeated start and address
+        return clocks / self.hz + self.t_trans
+
+    def _record(self, kind, dev, reg, cnt):
+        cost = self.cost(kind, cnt)
+        self.log.append((perf_counter(), kind, dev, reg, cnt, cost))
+        self.busy += cost
+        if self.realtime:
+            sleep(cost)
+
+    # ---------- SMBus interface ----------------------------------------------
+    def write_byte_data(self, dev, reg, val):
+        self._record(WRITE, dev, reg, 1)
+        self._write(dev, reg, [val])
+
+    def write_i2c_block_data(self, dev, reg, vals):
+        self._record(WRITE, dev, reg, len(vals))
+        self._write(dev, reg, vals)
+
+    def read_byte_data(self, dev, reg):
+        self._record(READ, dev, reg, 1)
+        return self._read(dev, reg, 1)[0]
+
+    def read_i2c_block_data(self, dev, reg, cnt):
+        self._record(READ, dev, reg, cnt)
+        return self._read(dev, reg, cnt)
+
+    # ---------- device models ------------------------------------------------
+    def _write(self, dev, reg, vals):
+        if dev in self.pca:
+            regs = self.pca[dev]
+            if (regs[MODE1] & AI):
+                for i in range(len(vals)):
+                    regs[(reg + i) & 0xFF] = vals[i] & 0xFF
+            else:
+                regs[reg] = vals[-1] & 0xFF
+            if (reg <= ALL_LED_ON_L + 3) and (reg + len(vals) > ALL_LED_ON_L):
+                # the ALL_LED registers load the registers of all channels
+                for chnl in range(16):
+                    base = LED0_ON_L + 4 * chnl
+                    regs[base:base + 4] = regs[ALL_LED_ON_L:ALL_LED_ON_L + 4]
+        elif (dev == ADS_ADDR) and (reg == REG_CFG) and (len(vals) == 2):
+            self.ads_cfg = (vals[0] << 8) | vals[1]
+            self._convert()
+        if self.listener is not None:
+            self.listener(dev, reg, vals)
+
+    def _convert(self):
+        '''Starts a conversion of the ADS1115 with the current config'''
+        cfg = self.ads_cfg
+        mux = (cfg >> 12) & 0x07
+        fsr = ADS_FSR[(cfg >> 9) & 0x07]
+        rate = ADS_RATE[(cfg >> 5) & 0x07]
+        volt = self.ain[mux - 4] if mux >= 4 else 0.0
+        code = int(volt / fsr * 32767)
+        self.ads_conv = max(-32768, min(32767, code)) & 0xFFFF
+        self.ads_ready = perf_counter() + 1.0 / rate
+        self.ads_cfg &= ~OS
+
+    def _read(self, dev, reg, cnt):
+        if dev in self.pca:
+            regs = self.pca[dev]
+            return [regs[(reg + i) & 0xFF] for i in range(cnt)]
+        if (dev == ADS_ADDR):
+            ready = perf_counter() >= self.ads_ready
+            if (reg == REG_CFG):
+                val = self.ads_cfg | (OS if ready else 0)
+            else:
+                val = self.ads_conv
+                if ready and not (self.ads_cfg & SINGLE):
+                    self._convert()      # continuous mode
+            return [(val >> 8) & 0xFF, val & 0xFF][:cnt]
+        return [0] * cnt
+
+    # ---------- evaluation ---------------------------------------------------
+    def pwm(self, chnl, dev=PCA_ADDR):
+        '''Returns the (on, off) register values of a channel'''
+        regs = self.pca[dev]
+        base = LED0_ON_L + 4 * chnl
+        return (regs[base] | (regs[base + 1] << 8),
+                regs[base + 2] | (regs[base + 3] << 8))
+
+    def report(self):
+        '''Statistics since the last reset'''
+        elapsed = perf_counter() - self.t0
+        cnt = len(self.log)
+        nbytes = sum(t[T_CNT] for t in self.log)
+        worst = max((t[T_COST] for t in self.log), default=0.0)
+        return {'transactions': cnt, 'bytes': nbytes, 'busy': self.busy,
+                'utilisation': self.busy / elapsed if elapsed > 0 else 0.0,
+                'mean': self.busy / cnt if cnt else 0.0, 'max': worst}
+
+def bench(telegrams, period=0.03, model=rccfg.MODEL):
+    '''Feeds a stream of binary control telegrams into rcapp and returns the
+    bus time per telegram and the utilisation at the given telegram period
+    (simulated time, independent of the speed of the host)
+    '''
+    import pca9685 as PWM
+    import rcapp
+    # SimBus of the module i2csim, not of __main__ when run as a script
+    if not hasattr(PWM.bus, 'busy'):
+        raise RuntimeError("rccfg.SIM has to be set for the benchmark")
+    bus = PWM.bus
+    rcapp.load_model(model)
+    PWM.init()
+    PWM.set_pwm_freq(rccfg.FREQ)
+    rcapp.fail_safe()
+    bus.reset()
+    lat = []
+    for tel in telegrams:
+        busy = bus.busy
+        rcapp.receive(tel)
+        lat.append(bus.busy - busy)
+    lat.sort()
+    n = len(lat)
+    return {'telegrams': n, 'transactions': len(bus.log),
+            'bytes': sum(t[T_CNT] for t in bus.log),
+            'utilisation': sum(lat) / (n * period),
+            'p50': lat[n // 2], 'p99': lat[min(n - 1, n * 99 // 100)],
+            'max': lat[-1]}
+
+def stick_stream(cnt=1000, period=0.03, chans=(0, 3)):
+    '''Binary telegrams of sticks moving slowly on a sine'''
+    tels = []
+    for i in range(cnt):
+        bitmap = 0
+        vals = []
+        for ch in chans:
+            bitmap |= 1 << ch
+            vals.append(127 + int(127 * sin(2 * pi * 0.2 * i * period + ch)))
+        tels.append(bytes([0xB2, 2, 0, 2, bitmap & 0xFF, bitmap >> 8]
+                          + vals + [0, 0]))
+    return tels
+
+def main():
+    ''' python3 i2csim.py [bus clock in Hz] with rccfg.SIM = True'''
+    if (len(sys.argv) > 1):
+        import pca9685 as PWM
+        PWM.bus.hz = int(sys.argv[1])
+    res = bench(stick_stream())
+    for key in res:
+        print (key, res[key])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        Network state
+# Purpose:     Cached address, netmask and broadcast address of the network
+#              interface, updated by rtnetlink events instead of polling
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+import sys
+import socket
+import select
+import struct
+from time import sleep, monotonic
+from threading import Thread, Condition
+import netifaces as ni
+
+NO_ADDR = "127.0.0.0"
+NO_MASK = "255.255.255.0"
+# rtnetlink multicast groups
+RTMGRP_LINK = 0x01
+RTMGRP_IPV4_IFADDR = 0x10
+POLL = 1.0     # s between two checks without rtnetlink
+CHECK = 10.0   # s between two checks with rtnetlink (missed events)
+
+# cached state of the monitored interface, written by refresh() only
+ifname = None
+addr = NO_ADDR
+netmask = NO_MASK
+broadcast = "127.0.0.255"
+version = 0          # incremented on each change of the state
+listeners = []       # callback() on each change, called by the monitor
+cond = Condition()   # notified on each change
+monitor = None
+
+def get_ip_address(name):
+    '''Address of the interface, cached if it is the monitored one'''
+    if (name == ifname) and (monitor is not None):
+        return addr
+    return read_state(name)[0]
+
+def broadcast_address(ip, mask):
+    '''Broadcast address of the network of ip with the netmask'''
+    i = struct.unpack('>I', socket.inet_aton(ip))[0]
+    m = struct.unpack('>I', socket.inet_aton(mask))[0]
+    return socket.inet_ntoa(struct.pack('>I', i | (~m & 0xFFFFFFFF)))
+
+def read_state(name):
+    '''(address, netmask, broadcast address) of the interface'''
+    try:
+        inet = ni.ifaddresses(name)[ni.AF_INET][0]
+        ip = inet['addr']
+        mask = inet.get('netmask') or NO_MASK
+        return (ip, mask, broadcast_address(ip, mask))
+    except (KeyError, IndexError, ValueError, OSError):
+        return (NO_ADDR, NO_MASK, broadcast_address(NO_ADDR, NO_MASK))
+
+def refresh():
+    '''Reads the state of the monitored interface, returns True and calls
+    the listeners if it has changed
+    '''
+    global addr, netmask, broadcast, version
+    state = read_state(ifname)
+    with cond:
+        if (state == (addr, netmask, broadcast)):
+            return False
+        addr, netmask, broadcast = state
+        version += 1
+        cond.notify_all()
+    print ("network", ifname, addr, netmask, broadcast)
+    for callback in listeners:
+        callback()
+    return True
+
+def subscribe(callback):
+    '''callback() is called by the monitor on each change of the state'''
+    listeners.append(callback)
+
+def netlink_socket():
+    '''rtnetlink socket receiving link and IPv4 address changes,
+    None if not available (not Linux)
+    '''
+    try:
+        nl = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                           socket.NETLINK_ROUTE)
+        nl.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        return nl
+    except (AttributeError, OSError):
+        return None
+
+def Monitor_loop(nl):
+    '''Updates the state on each rtnetlink event, polls without rtnetlink'''
+    while True:
+        if nl is None:
+            sleep(POLL)
+        elif select.select([nl], [], [], CHECK)[0]:
+            # all pending events result in one update
+            while select.select([nl], [], [], 0)[0]:
+                nl.recv(65536)
+        refresh()
+
+def start(name):
+    '''Starts the monitor of the interface (once)'''
+    global ifname, monitor
+    if monitor is not None:
+        return
+    ifname = name
+    # subscribed before the first check, no change can be missed
+    nl = netlink_socket()
+    refresh()
+    monitor = Thread(target = Monitor_loop, args = (nl,), daemon = True)
+    monitor.start()
+
+def wait_for_address(name, timeout=None):
+    '''Starts the monitor and blocks until the interface has an IPv4
+    address, returns it or NO_ADDR after the timeout (s)
+    '''
+    start(name)
+    with cond:
+        if (addr == NO_ADDR):
+            print ("waiting for networking")
+        cond.wait_for(lambda: addr != NO_ADDR, timeout)
+        return addr
+
+def main():
+    ''' python3 netstate.py [interface]'''
+    name = sys.argv[1] if (len(sys.argv) > 1) else "wlan0"
+    t0 = monotonic()
+    ip = wait_for_address(name)
+    print (name, ip, round(monotonic() - t0, 3), "s")
+    # prints the changes until interrupted
+    while True:
+        sleep(1.0)
+
+if __name__ == '__main__':
+    main()
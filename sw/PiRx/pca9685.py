@@ -15,31 +15,27 @@
 # Licence:     MIT see https://opensource.org/licenses/MIT
 # ----------------------------------------------------------------------------
 import time
-from rccfg import SIM
-
-if SIM:
-    class Sbus():
-        def __init__(self):
-                pass                   
-        def write_byte_data(self, dev, reg, val):
-            pass
-        #print (hex(dev), hex(reg), hex(val))  
-            
-        def write_i2c_block_data(self, dev, reg, val):
-            pass
-            
-        def read_byte_data(self, dev, reg):
-            return 0x00
-            
-        def read_i2c_block_data(self, dev, reg, cnt):
-            return 0x00, 0x00
-        
-    bus = Sbus()
-else:
-    import smbus
-    bus = smbus.SMBus(1)
+import heapq
+from itertools import count
+from threading import Thread, Event, Condition
+from rccfg import SIM, boards
+
+# one bus object for each I2C bus used by the boards in rccfg.boards 
+buses = {}
+for busno, addr in boards.values():
+    if SIM:
+        # simulated bus with register files and timing model of the boards
+        from i2csim import SimBus
+        if busno not in buses:
+            buses[busno] = SimBus()
+        buses[busno].add_pca(addr)
+    elif busno not in buses:
+        import smbus
+        buses[busno] = smbus.SMBus(busno)
+# bus and address of board 0, the ADS1115 is connected to the same bus
+bus = buses[boards[0][0]]
+PCA9685_ADDR = boards[0][1]
     
-PCA9685_ADDR       = 0x40
 MODE1              = 0x00
 MODE2              = 0x01
 SUBADR1            = 0x02
@@ -61,61 +57,360 @@ SLEEP              = 0x10
 ALLCALL            = 0x01
 INVRT              = 0x10
 OUTDRV             = 0x04
+AI                 = 0x20   # register auto increment
 MAX_I_P9685 = 4095
+PINS = 16                      # outputs of one board
+NBOARD = len(boards)
+NCHAN = PINS * NBOARD          # logical channels, 16 * board + pin
+# channel map: logical channel => (bus number, board address, pin)
+chanmap = []
+for board in range(NBOARD):
+    for pin in range(PINS):
+        chanmap.append((boards[board][0], boards[board][1], pin))
+MAX_BLOCK = 32     # max. count of data bytes within one smbus block write
+
+# LED register contents (ON_L, ON_H, OFF_L, OFF_H) of a digital output
+DIO_OFF = (0x00, 0x00, 0x00, 0x10)
+DIO_ON = (0x00, 0x10, 0x00, 0x00)
+
+MAX_GAP = 3        # unchanged registers bridged instead of a new transaction
+
+# frame buffer, pending LED register contents of each channel 
+# None => channel unchanged within the current frame
+frame = [None] * NCHAN
+# shadow copy of the LED registers LED0_ON_L..LED15_OFF_H of all boards 
+# (4 registers per logical channel), -1 => unknown
+shadow = [-1] * (4 * NCHAN)
+# statistics: I2C transactions / bytes put on the bus, 
+# channel updates written / suppressed because the registers were unchanged 
+stat = {'trans': 0, 'bytes': 0, 'written': 0, 'suppressed': 0}
 
 def init():
-    ''' 
+    ''' Auto increment is enabled first, all block writes rely on it
     '''          
+    for busno, addr in boards.values():
+        buses[busno].write_byte_data(addr, MODE1, ALLCALL | AI | SLEEP)
     set_all_pwm (0,0)
-    bus.write_byte_data(PCA9685_ADDR, MODE2, OUTDRV)
-    bus.write_byte_data(PCA9685_ADDR, MODE1, ALLCALL)
+    for busno, addr in boards.values():
+        b = buses[busno]
+        b.write_byte_data(addr, MODE2, OUTDRV)
+        b.write_byte_data(addr, MODE1, ALLCALL | AI)
     time.sleep(0.005)
-    mode1 = bus.read_byte_data(PCA9685_ADDR, MODE1)
-    mode1 = mode1 & ~SLEEP
-    bus.write_byte_data(PCA9685_ADDR, MODE1, mode1)
+    for busno, addr in boards.values():
+        b = buses[busno]
+        mode1 = b.read_byte_data(addr, MODE1)
+        mode1 = mode1 & ~SLEEP
+        b.write_byte_data(addr, MODE1, mode1)
     time.sleep(0.005)
+    start_owners()
 
 def software_reset():
-    bus.write_byte_data(0x00, 0x06)
+    _call(boards[0][0], ACTUATOR, 'write_byte_data', 0x00, 0x06)
 
 def set_pwm_freq(hz):
     """Set the PWM frequency to the provided value in hertz."""
     prescale = int( round (25000000 / (4096 * hz)) - 1)
-    oldmode = bus.read_byte_data(PCA9685_ADDR, MODE1);
-    newmode = (oldmode & 0x7F) | SLEEP
-    bus.write_byte_data(PCA9685_ADDR, MODE1, newmode)
-    bus.write_byte_data(PCA9685_ADDR, PRESCALE, prescale)
-    bus.write_byte_data(PCA9685_ADDR, MODE1, oldmode)
-    time.sleep(0.005)
-    bus.write_byte_data(PCA9685_ADDR, MODE1, oldmode | RESTART)
+    for busno, addr in boards.values():
+        oldmode = _call(busno, ACTUATOR, 'read_byte_data', addr, MODE1)
+        newmode = (oldmode & 0x7F) | SLEEP
+        _call(busno, ACTUATOR, 'write_byte_data', addr, MODE1, newmode)
+        _call(busno, ACTUATOR, 'write_byte_data', addr, PRESCALE, prescale)
+        _call(busno, ACTUATOR, 'write_byte_data', addr, MODE1, oldmode)
+        time.sleep(0.005)
+        _call(busno, ACTUATOR, 'write_byte_data', addr, MODE1, 
+              oldmode | RESTART)
+
+def _store(chnl, regs):
+    """Writes the register contents of a channel and updates the shadow"""
+    busno, addr, pin = chanmap[chnl]
+    _call(busno, ACTUATOR, 'write_i2c_block_data', addr, LED0_ON_L + 4 * pin, 
+          list(regs))
+    base = 4 * chnl
+    shadow[base:base + 4] = regs
+    stat['trans'] += 1
+    stat['bytes'] += 4
+    stat['written'] += 1
 
 def set_pwm(chnl, on, off):
     """Sets a single PWM channel."""
-    bus.write_byte_data(PCA9685_ADDR, LED0_ON_L + (4 * chnl), on & 0xFF)
-    bus.write_byte_data(PCA9685_ADDR, LED0_ON_H  + (4 * chnl), on >> 8)
-    bus.write_byte_data(PCA9685_ADDR, LED0_OFF_L + (4 * chnl), off & 0xFF)
-    bus.write_byte_data(PCA9685_ADDR, LED0_OFF_H + (4 * chnl), off >> 8)  
+    _store(chnl, (on & 0xFF, on >> 8, off & 0xFF, off >> 8))
                    
 def set_all_pwm(on, off):
     """Sets all PWM channels."""
-    bus.write_byte_data(PCA9685_ADDR, ALL_LED_ON_L, on & 0xFF)
-    bus.write_byte_data(PCA9685_ADDR, ALL_LED_ON_H, on >> 8)
-    bus.write_byte_data(PCA9685_ADDR, ALL_LED_OFF_L, off & 0xFF)
-    bus.write_byte_data(PCA9685_ADDR, ALL_LED_OFF_H, off >> 8)
+    regs = (on & 0xFF, on >> 8, off & 0xFF, off >> 8)
+    for busno, addr in boards.values():
+        _call(busno, ACTUATOR, 'write_i2c_block_data', addr, ALL_LED_ON_L, 
+              list(regs))
+        stat['trans'] += 1
+        stat['bytes'] += 4
+    # the ALL_LED registers load the LED registers of every channel
+    shadow[:] = regs * NCHAN
 
 def set_dio(chnl, state):
     """ state == 0 => OFF, state != 0  => ON 
     """
     if (state == 0):  
-        bus.write_byte_data(PCA9685_ADDR, LED0_ON_L  + (4 * chnl), 0x00)
-        bus.write_byte_data(PCA9685_ADDR, LED0_ON_H  + (4 * chnl), 0x00)
-        bus.write_byte_data(PCA9685_ADDR, LED0_OFF_L  + (4 * chnl), 0x00)
-        bus.write_byte_data(PCA9685_ADDR, LED0_OFF_H  + (4 * chnl), 0x10)
+        _store(chnl, DIO_OFF)
     else:  
-        bus.write_byte_data(PCA9685_ADDR, LED0_ON_L  + (4 * chnl), 0x00)
-        bus.write_byte_data(PCA9685_ADDR, LED0_ON_H  + (4 * chnl), 0x10)
-        bus.write_byte_data(PCA9685_ADDR, LED0_OFF_L  + (4 * chnl), 0x00)
-        bus.write_byte_data(PCA9685_ADDR, LED0_OFF_H  + (4 * chnl), 0x00)
+        _store(chnl, DIO_ON)
+
+def invalidate():
+    """Forgets the shadow registers, the next commit writes every channel"""
+    shadow[:] = [-1] * (4 * NCHAN)
+
+# ---------- frame oriented output --------------------------------------------
+# The frame_xxx functions only store the register contents of a channel. 
+# commit() compares the frame with the shadow registers and writes only the
+# bytes that changed, adjacent changes are coalesced into one block write 
+# using the auto increment of the chip. The blocks are written by the owner
+# threads of the buses, in parallel with boards on more than one bus.
+
+def frame_pwm(chnl, on, off):
+    """Stores the PWM values of a channel in the frame buffer"""
+    frame[chnl] = (on & 0xFF, on >> 8, off & 0xFF, off >> 8)
+
+def frame_dio(chnl, state):
+    """Stores a digital output in the frame buffer
+    state == 0 => OFF, state != 0  => ON 
+    """
+    if (state == 0):
+        frame[chnl] = DIO_OFF
+    else:
+        frame[chnl] = DIO_ON
+
+# per bus: pending blocks (address, register, data) of the current commit
+blocks = {}
+for busno in buses:
+    blocks[busno] = []
+
+def _add_block(first, last):
+    """Adds the registers first..last (shadow indexes) to the blocks"""
+    busno, addr, pin = chanmap[first >> 2]
+    blocks[busno].append((addr, LED0_ON_L + 4 * pin + (first & 3), 
+                          shadow[first:last + 1]))
+    stat['trans'] += 1
+    stat['bytes'] += last + 1 - first
+
+def _bridge(first, last, reg):
+    """True if the registers between last and reg can be rewritten 
+    within the block starting at first 
+    """
+    if ((reg - last - 1) > MAX_GAP) or ((reg - first) >= MAX_BLOCK):
+        return False
+    if ((first // (4 * PINS)) != (reg // (4 * PINS))):
+        return False     # other board
+    for r in range(last + 1, reg):
+        if shadow[r] < 0:
+            return False
+    return True
+
+# write_hook(dev, reg, data) is called for each block write (black box)
+write_hook = None
+
+def _write_blocks(b, blks):
+    for addr, reg, data in blks:
+        b.write_i2c_block_data(addr, reg, data)
+        if write_hook is not None:
+            write_hook(addr, reg, data)
+
+# ---------- bus owner ---------------------------------------------------------
+# After init() every bus is used by its owner thread only. The other threads 
+# (receiver, watchdog, output scheduler, ADS1115 sampler) post requests with 
+# a priority and wait for the result. Pending requests are executed by
+# priority, frames waiting at the same time are merged into one batch.
+
+FAILSAFE, ACTUATOR, ADC = range(3)     # request priorities, 0 = highest
+PRIO_NAMES = ('failsafe', 'actuator', 'adc')
+CALL, FRAME = range(2)                 # request kinds
+# heap entries (priority, request number, time posted, kind, data, result)
+# result = [done event, return value, exception]
+PRIO, NO, POSTED, KIND, DATA, RESULT = range(6)
+pending = {}       # per bus: heap of the requests
+cond = {}          # per bus: condition of the heap
+owners = {}        # per bus: owner thread
+req_no = count()
+# statistics of the owners
+sched_stat = {'depth_max': 0, 'batched': 0}
+for name in PRIO_NAMES:
+    sched_stat[name] = 0                 # count of requests
+    sched_stat[name + '_wait_sum'] = 0.0 # time from post to execution in s
+    sched_stat[name + '_wait_max'] = 0.0
+
+def _post(busno, prio, kind, data):
+    """Posts a request to the owner of the bus, returns its result cell"""
+    res = [Event(), None, None]
+    c = cond[busno]
+    with c:
+        heap = pending[busno]
+        heapq.heappush(heap, (prio, next(req_no), time.perf_counter(), 
+                              kind, data, res))
+        if (len(heap) > sched_stat['depth_max']):
+            sched_stat['depth_max'] = len(heap)
+        c.notify()
+    return res
+
+def _wait(res):
+    res[0].wait()
+    if res[2] is not None:
+        raise res[2]
+    return res[1]
+
+def _call(busno, prio, name, *args):
+    """Calls an SMBus method, by the owner of the bus if it is running"""
+    if busno not in owners:
+        return getattr(buses[busno], name)(*args)
+    return _wait(_post(busno, prio, CALL, (name, args)))
+
+def _merge(frames):
+    """Merges the blocks of several frames (in the order they were posted),
+    later register contents replace earlier ones
+    """
+    regs = {}
+    for blks in frames:
+        for addr, reg, data in blks:
+            for i in range(len(data)):
+                regs[(addr, reg + i)] = data[i]
+    merged = []
+    for addr, reg in sorted(regs):
+        if merged:
+            maddr, mreg, mdata = merged[-1]
+            if ((maddr == addr) and (mreg + len(mdata) == reg) and 
+                (len(mdata) < MAX_BLOCK)):
+                mdata.append(regs[(addr, reg)])
+                continue
+        merged.append((addr, reg, [regs[(addr, reg)]]))
+    return merged
+
+def Bus_owner(busno):
+    b = buses[busno]
+    c = cond[busno]
+    heap = pending[busno]
+    while True:
+        with c:
+            while not heap:
+                c.wait()
+            batch = [heapq.heappop(heap)]
+            if (batch[0][KIND] == FRAME):
+                while heap and (heap[0][KIND] == FRAME):
+                    batch.append(heapq.heappop(heap))
+        t = time.perf_counter()
+        for req in batch:
+            name = PRIO_NAMES[req[PRIO]]
+            wait = t - req[POSTED]
+            sched_stat[name] += 1
+            sched_stat[name + '_wait_sum'] += wait
+            if (wait > sched_stat[name + '_wait_max']):
+                sched_stat[name + '_wait_max'] = wait
+        try:
+            if (batch[0][KIND] == CALL):
+                name, args = batch[0][DATA]
+                batch[0][RESULT][1] = getattr(b, name)(*args)
+            elif (len(batch) == 1):
+                _write_blocks(b, batch[0][DATA])
+            else:
+                batch.sort(key = lambda req: req[NO])
+                sched_stat['batched'] += len(batch) - 1
+                _write_blocks(b, _merge([req[DATA] for req in batch]))
+        except Exception as exc:
+            print ("I2C bus " + str(busno) + " failed: " + repr(exc))
+            for req in batch:
+                req[RESULT][2] = exc
+        for req in batch:
+            req[RESULT][0].set()
+
+def start_owners():
+    """Starts the owner thread of each bus"""
+    for busno in buses:
+        if busno not in owners:
+            pending[busno] = []
+            cond[busno] = Condition()
+            owners[busno] = Thread(target = Bus_owner, args = (busno,), 
+                                   daemon = True)
+            owners[busno].start()
+
+class BusClient():
+    """SMBus interface for the other drivers on a bus (ADS1115), the 
+    requests are executed by the owner of the bus with the priority 
+    """
+    def __init__(self, busno, prio):
+        self.busno = busno
+        self.prio = prio
+
+    def write_byte_data(self, dev, reg, val):
+        return _call(self.busno, self.prio, 'write_byte_data', dev, reg, val)
+
+    def write_i2c_block_data(self, dev, reg, vals):
+        return _call(self.busno, self.prio, 'write_i2c_block_data', 
+                     dev, reg, vals)
+
+    def read_byte_data(self, dev, reg):
+        return _call(self.busno, self.prio, 'read_byte_data', dev, reg)
+
+    def read_i2c_block_data(self, dev, reg, cnt):
+        return _call(self.busno, self.prio, 'read_i2c_block_data', 
+                     dev, reg, cnt)
+
+# bus of board 0 for the ADS1115, the ADC reads have the lowest priority
+adc_bus = BusClient(boards[0][0], ADC)
+
+def commit(prio=ACTUATOR):
+    """Writes the changed registers of the frame buffer to the boards 
+    with the priority (FAILSAFE or ACTUATOR) 
+    Returns the count of I2C transactions 
+    """
+    cnt = stat['trans']
+    first = -1   # first register of the pending block
+    last = -1    # last register of the pending block
+    for chnl in range(NCHAN):
+        regs = frame[chnl]
+        if regs is None:
+            continue
+        frame[chnl] = None
+        base = 4 * chnl
+        if (shadow[base] == regs[0] and shadow[base + 1] == regs[1] and 
+            shadow[base + 2] == regs[2] and shadow[base + 3] == regs[3]):
+            stat['suppressed'] += 1
+            continue
+        stat['written'] += 1
+        for i in range(4):
+            reg = base + i
+            if (shadow[reg] == regs[i]):
+                continue
+            if (first >= 0) and not _bridge(first, last, reg):
+                _add_block(first, last)
+                first = -1
+            if (first < 0):
+                first = reg
+            last = reg
+            shadow[reg] = regs[i]
+    if (first >= 0):
+        _add_block(first, last)
+    # post the blocks to the owners, the buses are written in parallel
+    posted = []
+    error = None
+    for busno in blocks:
+        blks = blocks[busno]
+        if not blks:
+            continue
+        blocks[busno] = []
+        if busno in owners:
+            posted.append(_post(busno, prio, FRAME, blks))
+        else:
+            try:
+                _write_blocks(buses[busno], blks)
+            except Exception as exc:
+                error = exc
+    for res in posted:
+        try:
+            _wait(res)
+        except Exception as exc:
+            error = exc
+    if error is not None:
+        # the shadow no longer matches the boards, the next commit
+        # writes every channel again
+        invalidate()
+        raise error
+    return stat['trans'] - cnt
 
 
 if __name__ == "__main__":
@@ -10,33 +10,27 @@
 # Copyright:   (c) Bernd Hinze 2020
 # Licence:     MIT see https://opensource.org/licenses/MIT
 # -----------------------------------------------------------------------------
-import netifaces as ni
 import socket
-from time import time, sleep
-from os import system
+import asyncio
+import struct
+from time import time, sleep, perf_counter, clock_gettime, CLOCK_BOOTTIME
+from os import system, stat, sysconf
+import runpy
 import queue
-from threading import Thread
+from threading import Thread, Event, RLock
 import pca9685 as PWM         # PWM Board Package
+import chplan
 import ads1115 as ads         # pca9685 has to be allready loaded
+import rcstats as stats
+import netstate
+import blackbox
 import rccfg 
 
 # queue that is used for communication between the observer thread -reading 
 # sensor data and the UDP-Client class that transmits the data 
 # to the transmitter 
-q_time = queue.LifoQueue(20)
 q_Udp_to_OBS = queue.Queue(20)
  
-def get_ip_address(ifname):
-    try:
-        return ni.ifaddresses(ifname)[ni.AF_INET][0]['addr']
-    except:
-        return "127.0.0.0"
-         
-def get_bc_address(ifname):
-    ip = get_ip_address(ifname).split('.')
-    bcip = ip[0] + '.' + ip[1] + '.' + ip[2] + '.' + '255'
-    return bcip
-
 def bytostr(inp):
     '''Converts an integer < 256 into a coded string'''
     if (inp < 256):
@@ -51,212 +45,470 @@ def strtobyte (codstr):
         return (ord(codstr[0])-48)*16 + (ord(codstr[1])-48)
     else: return -1
                
-# Elements of of configuration
-MODE, CENTER, RATE, REVERSE, ACCFILT, FAILSAFE, STEPW, CENTER_TR = range(8) 
-LASTVAL = 0  # index for Globdata[chan][LASTVAL]
-# Configuration for each channel with following cells
-#  MODE, CENTER, RATE, REVERSE, ACCFILT, FAILSAFE, STEPW, CENTER_TR
-Conf = [] 
-#Globdata with the default center position 
-GlobData = []
-# table for inputs to be reversed 
-revVal = []
-imp_tab = []   
+# channel plan of the model (tuple of chplan.Channel), compiled by load_model
+plan = ()
 lockup = ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9",
                        ":", ";", "<", "=", ">", "?"]
+
+# Binary control telegram, version 2 (values are single bytes)
+#   TEL2_MAGIC, version, flags, [seq (2 bytes), time stamp (4 bytes)], 
+#   [receiver ID], nmap, bitmap[nmap], 
+#   value of each channel set in the bitmap (1 byte),
+#   ntrim, (chan, trim) * ntrim, ncmd, (chan, val) * ncmd
+# The bitmap is LSB first, bit n of byte k is channel 8*k + n.
+# Receivers of version 1 fail on it (the utf-8 decoding raises), the
+# transmitter sends it by unicast only, to receivers announcing version 2.
+# The broadcast to all receivers (GPcfg.receivers empty) is ASCII.
+# With F_SEQ the sender adds a sequence number and its time in ms (big endian).
+# With F_ADDR the telegram is addressed to one receiver (rccfg.RX_ID), 
+# ID 0 addresses all receivers.
+# With F_TM the transmitter accepts the telemetry telegram, it is sent only
+# to a transmitter that set it in its last control telegram.
+TEL2_MAGIC = 0xB2
+TEL_VERSION = 2    # announced within the Rx_BC telegram
+F_RESERVED = 0x01  # no values are taken from telegrams with it
+F_SEQ = 0x02
+F_ADDR = 0x04
+F_TM = 0x08
+
+# Binary telemetry telegram to the transmitter (rccfg.TM_PERIOD), big endian
+#   TM_MAGIC, version, receiver ID, state, 
+#   accepted (4 bytes), lost (4 bytes), stale (4 bytes), errors (2 bytes), 
+#   fail safe events (2 bytes), WiFi link quality, level (dBm), noise (dBm),
+#   nain, (input, value in 10 mV as signed 2 bytes) * nain
+# lost and stale are the counts of the sequence check, stale includes 
+# reordered and duplicated telegrams
+TM_MAGIC = 0xB3
+TM_VERSION = 1
+TM_HDR = struct.Struct('>BBBBIIIHHBbbB')
+TM_AIN = struct.Struct('>Bh')
+TM_FAILSAFE = 0x01    # state: the outputs are in the fail safe state
     
-def CtrData_init():
-    '''Init the Globdata with the default center position 
-    Filling the channel impulse tab   
+def load_model(name=rccfg.MODEL):
+    '''Compiles the channel plan of the model, raises ValueError for an 
+    invalid configuration
     '''
-    global Conf, GlobData, revVal, imp_tab
-    for  i in range (16):
-        Conf.append([rccfg.SERVO, 1.5, 0.5, False, False, 127, 127, 1.5]) 
-        GlobData.append([127]) 
-    for i in range (255):
-        revVal.append(254 - i) 
-    for c in range (16):
-            tab = [] 
-            for i in range(255):                 
-                tab.append(PcaVal(c, i))
-            imp_tab.append(tab)
-                
-def PcaVal (chan, telval):
-    """Calculates the puls value (0..4065) for the pca9685 module
-    
-    tval = message input 0..254
-    [RATE] = maximal diviation (0..0.5) from the servo center puls duration 
-    [CENTER_TR] = servo center puls duration with timm adjustment 
-    [REVERSE] boolean for reverse operation
-    """
-    rate = Conf[chan][RATE]
-    center = Conf[chan][CENTER_TR] 
-    servoVal = telval
-    if Conf[chan][REVERSE]:
-        servoVal = revVal[telval]
-    ival = 2 *  rate * servoVal / 254.0  + center - rate
-    pval =  ival * rccfg.FREQ / 1000 * PWM.MAX_I_P9685
-    return int(round(pval, 0))
-   
-def PcaHVal(chan, telval):
-    IN1 = chan + 1
-    IN2 = chan + 2
-    """Calculates the puls value (0..4065) for the pca9685 module    
-    tval = message input 0..254
-    """
-    cntimpuls = round(abs(telval-127)*32.008)
-    PWM.set_pwm(chan, 0, cntimpuls)
-    #print ("H " , cntimpuls)    
-    if (telval < 127):          
-        PWM.set_dio(IN1, 0)
-        PWM.set_dio(IN2, 1)  
-    elif (telval > 127):
-        PWM.set_dio(IN1, 1)
-        PWM.set_dio(IN2, 0)  
-    else: 
-        PWM.set_dio(IN1, 0)
-        PWM.set_dio(IN2, 0)
-                       
-def configure_channel(mod, chan,  center, rate, reverse=False, \
-                    accfilt=False, failsafe=127, stepw = 127): 
-    global Conf, GlobData, imp_tab
-    trimmctr = center
-    Conf[chan] = [mod, center, rate, reverse, accfilt, failsafe, stepw, trimmctr]
-    GlobData[chan] = [failsafe] 
-    if (mod == rccfg.L298):
-        for i in range (255):
-            imp_tab[chan][i] = round(abs(i-127)*PWM.MAX_I_P9685/127)
-    else:
-        for i in range(255):                 
-            imp_tab[chan][i] = PcaVal(chan, i)        
-
-first = False
-
-def acc_filter(chan, inp): 
-    """ Decrease the input rise rate for an channel"""
-    global GlobData, first
-    da = Conf[chan][STEPW]
-    centerpos = Conf[chan][FAILSAFE]
-    def clamp(n, minn, maxn):
-        if n < minn:
-            return minn
-        elif n > maxn:
-            return maxn
-        else:
-            return n
-    an = GlobData[chan][LASTVAL]
-    if first: 
-        an = inp
-        first = False
-    if ((inp > centerpos) and (inp > (an + da))): 
-        cout = an + da   
-    elif ((inp < centerpos) and (inp < (an - da))): 
-        cout = an - da  
-    else:
-        cout = inp     
-    GlobData[chan][LASTVAL] = clamp(cout, 0, 254)
-    return GlobData[chan][LASTVAL]    
+    global plan
+    new = chplan.compile_plan(rccfg.models[name])
+    for ch in new:
+        sched_target[ch.chan] = ch.failsafe
+        sched_pos[ch.chan] = ch.failsafe
+    plan = new
         
-def update_PWM(chan, telval):
-    """Calls the pwm driver and sets the impuls rate for a channel """
-    mode = Conf[chan][MODE]
-    if Conf[chan][ACCFILT]:
-        telval = acc_filter(chan, telval)            
-    if (mode == rccfg.SERVO):
-        PWM.set_pwm(chan, 0, imp_tab[chan][telval])       
-    elif (mode == rccfg.DIO):
-        PWM.set_dio(chan, telval)
-    elif (mode == rccfg.L298):    
-        PcaHVal (chan, telval)                
+def commit_frame(prio=None):
+    '''Writes the frame of the pwm driver, frames of the fail safe state 
+    have the highest priority on the bus
+    '''
+    if prio is None:
+        prio = PWM.FAILSAFE if fs_active else PWM.ACTUATOR
+    if stats.ENABLED:
+        t0 = perf_counter()
+        PWM.commit(prio)
+        stats.observe('i2c', perf_counter() - t0)
+    else:
+        PWM.commit(prio)
         
 def fail_safe():
     '''Set all actuators to the fail safe position '''
-    for i in range(16):
-        update_PWM(i, Conf[i][FAILSAFE])           
+    with out_lock:
+        for ch in plan:
+            sched_target[ch.chan] = ch.failsafe
+            sched_pos[ch.chan] = ch.failsafe
+            ch.update(ch.failsafe)           
+        commit_frame(PWM.FAILSAFE)
+
+# ---------- output scheduler (rccfg.SCHED) -----------------------------------
+# The network path only stores the latest target of each channel, the 
+# scheduler moves the outputs towards the targets once per servo frame. 
+# The slew rate of a channel is STEPW per 20 ms, converted to units per s, so 
+# the ramp does not depend on the arrival of the telegrams. Like the filter
+# ACCFILT channels are only limited when moving away from the FAILSAFE value.
+
+sched_target = [127] * PWM.NCHAN   # latest value received for each channel
+sched_pos = [127.0] * PWM.NCHAN  # current output position of each channel 
+SLEW_BASE = 0.02              # time base of STEPW in s
+
+def sched_step(dt):
+    '''Moves all channels towards their targets, dt = time since last step'''
+    with out_lock:
+        for ch in plan:
+            i = ch.chan
+            target = sched_target[i]
+            pos = sched_pos[i]
+            if (pos != target):
+                if fs_active and (ch.fsmode == rccfg.RAMP):
+                    step = ch.fsrate * dt
+                elif (ch.mode == rccfg.DIO):
+                    step = 255
+                elif (not ch.accfilt or 
+                      ((target > ch.failsafe) and (target > pos)) or
+                      ((target < ch.failsafe) and (target < pos))):
+                    step = ch.stepw * dt / SLEW_BASE
+                else: 
+                    step = 255
+                if (pos < target):
+                    pos = min(pos + step, target)
+                else:
+                    pos = max(pos - step, target)
+                sched_pos[i] = pos
+            val = int(round(pos))
+            ch.last = val
+            ch.output(val)
+        commit_frame()
+
+def Output_loop():
+    print("Output scheduler running")
+    period = 1 / rccfg.FREQ
+    tnext = time()
+    tstep = tnext
+    while True:
+        tnext += period
+        delay = tnext - time()
+        if (delay > 0):
+            sleep(delay)
+        else:
+            # overrun, the schedule restarts from now
+            tnext = time()
+        now = time()
+        try:
+            sched_step(now - tstep)
+        except Exception as exc:
+            # the scheduler keeps running, it drives the fail safe too
+            print ("Output scheduler: " + repr(exc))
+            stats.error(exc)
+        tstep = now
+
+# ---------- link loss watchdog -----------------------------------------------
+# Every valid control telegram re-arms the watchdog by link_alive(). When no 
+# telegram arrives within rccfg.WD_TIMEOUT the fail safe state is entered once,
+# each channel following its strategy: HOLD keeps the last value, JUMP sets 
+# the FAILSAFE value, RAMP moves to FAILSAFE with FSRATE units per second.
+
+out_lock = RLock()     # serializes the outputs of telegrams and fail safe
+wd_event = Event()     # set by every valid control telegram
+t_last_tel = time()    # time of the last valid control telegram
+rearmed = False        # the last received datagram has re-armed the watchdog
+tm_ok = False          # the transmitter accepts the telemetry telegram (F_TM)
+fs_active = False
+fs_pos = [0.0] * PWM.NCHAN    # ramp position of each channel 
+FS_CYCLE = 1 / rccfg.FREQ
+# watchdog statistics: count of link losses, detection latency of the last
+# and the worst link loss, time in fail safe state (total and last) in s
+wd_stat = {'events': 0, 'detect_last': 0.0, 'detect_max': 0.0, 
+           'fs_time': 0.0, 'fs_last': 0.0, 't_enter': 0.0}
+
+def link_alive():
+    '''Re-arms the watchdog, the fail safe state is left'''
+    global t_last_tel, fs_active
+    t_last_tel = time()
+    if fs_active:
+        with out_lock:
+            fs_active = False
+            wd_stat['fs_last'] = t_last_tel - wd_stat['t_enter']
+            wd_stat['fs_time'] += wd_stat['fs_last']
+        if blackbox.ENABLED:
+            blackbox.failsafe(False)
+    wd_event.set()
+
+def enter_failsafe():
+    '''Sets the channels according to their fail safe strategy
+    Returns True if any channel has to be ramped
+    '''
+    global fs_active
+    ramp = False
+    with out_lock:
+        now = time()
+        fs_active = True
+        detect = now - t_last_tel
+        wd_stat['events'] += 1
+        wd_stat['t_enter'] = now
+        wd_stat['detect_last'] = detect
+        wd_stat['detect_max'] = max(detect, wd_stat['detect_max'])
+        if rccfg.SCHED:
+            # the output scheduler ramps the channels 
+            for ch in plan:
+                i = ch.chan
+                if (ch.fsmode == rccfg.HOLD):
+                    sched_target[i] = int(round(sched_pos[i]))
+                else:
+                    sched_target[i] = ch.failsafe
+                    if (ch.fsmode == rccfg.JUMP):
+                        sched_pos[i] = ch.failsafe
+            return False
+        for ch in plan:
+            if (ch.fsmode == rccfg.JUMP):
+                ch.update(ch.failsafe)
+            elif (ch.fsmode == rccfg.RAMP):
+                fs_pos[ch.chan] = ch.last
+                ramp = True
+        commit_frame()
+    if blackbox.ENABLED:
+        blackbox.failsafe(True)
+    print ("Link lost -> fail safe")
+    return ramp
+
+def ramp_failsafe(dt):
+    '''Moves the RAMP channels towards their fail safe value
+    Returns True as long as a channel has not reached it
+    '''
+    ramp = False
+    with out_lock:
+        if not fs_active:
+            return False
+        for ch in plan:
+            if (ch.fsmode != rccfg.RAMP):
+                continue
+            i = ch.chan
+            target = ch.failsafe
+            step = ch.fsrate * dt
+            pos = fs_pos[i]
+            if (pos < target):
+                pos = min(pos + step, target)
+            elif (pos > target):
+                pos = max(pos - step, target)
+            fs_pos[i] = pos
+            ch.update(int(round(pos)))
+            if (pos != target):
+                ramp = True
+        commit_frame()
+    return ramp
+
+def wd_statistics():
+    '''Returns the watchdog statistics including a running fail safe'''
+    stat = dict(wd_stat)
+    stat['active'] = fs_active
+    if fs_active:
+        stat['fs_time'] += time() - wd_stat['t_enter']
+    return stat
+
+def Watchdog_loop():
+    print("Watchdog running")
+    while True:
+        if wd_event.wait(rccfg.WD_TIMEOUT):
+            wd_event.clear()
+        elif not fs_active:
+            ramp = enter_failsafe()
+            tstep = time()
+            while ramp and not wd_event.wait(FS_CYCLE):
+                now = time()
+                ramp = ramp_failsafe(now - tstep)
+                tstep = now
         
 def trimm_Chan(chan, trimm):  
-    """Change the trimm value of a channel in the Cfg table
+    """Change the trimm value of a channel
     trim = 0..50
     """ 
-    global Conf, imp_tab
-    center = Conf[chan][CENTER]
-    if Conf[chan][REVERSE]:
-        trimm = 50 - trimm
-    Conf[chan][CENTER_TR] = round(((center * (trimm - 25)/254) + center),3)
-    for i in range(255):                 
-        imp_tab[chan][i] = PcaVal(chan, i)
+    plan[chan].trim(trimm)
 
 def shutdown_rx(chan, telval):
     """Shutdown the system """
     if (telval == 0):
         fail_safe()
         sleep(1)
+        if blackbox.ENABLED:
+            blackbox.flush(b'shutdown')
         print ("Shutdown")
         if (not rccfg.SIM):
             system("sudo shutdown now") 
 
+# ---------- reload of the model configuration (rccfg.RELOAD) -----------------
+# The Config_loop watches the file of rccfg. When it changes, models and MODEL
+# are read from it (the other settings need a restart), the plan is compiled
+# on the Config_loop and swapped between two telegrams. Unchanged channels 
+# keep their state and are not written again. A command record CMD_MODEL 
+# selects a model by its index within rccfg.models (255 = MODEL of the file).
+
+CMD_MODEL = 14
+cfg_event = Event()    # set by the command record, reloads immediately
+cfg_select = None      # index of the model selected by the command record
+
+def swap_plan(new):
+    '''Replaces the plan, changed channels continue with their last value 
+    (or the fail safe value if the mode has changed) and keep their trim
+    '''
+    global plan
+    with out_lock:
+        new = list(new)
+        for i in range(len(new)):
+            old = plan[i]
+            ch = new[i]
+            if (ch.conf == old.conf):
+                new[i] = old
+                continue
+            if (ch.mode == old.mode):
+                ch.last = old.last
+                ch.trim(old.trimm)
+            else:
+                sched_target[i] = ch.failsafe
+                sched_pos[i] = ch.failsafe
+            ch.output(ch.last)
+        plan = tuple(new)
+        commit_frame()
+
+def reload_model(index=None):
+    '''Reads the models of the rccfg file and swaps in the plan of MODEL 
+    (or of the model with the index), returns False if the configuration 
+    is not valid, the plan in use is kept then
+    '''
+    try:
+        cfg = runpy.run_path(rccfg.__file__)
+        models = cfg['models']
+        model = cfg['MODEL']
+        if (index is not None):
+            model = list(models)[index]
+        new = chplan.compile_plan(models[model])
+    except Exception as exc:
+        print ("Model configuration not loaded: " + repr(exc))
+        return False
+    rccfg.models = models
+    rccfg.MODEL = model
+    swap_plan(new)
+    print ("Model " + model + " loaded")
+    return True
+
+def command(chan, telval):
+    '''Command records of the control telegram'''
+    global cfg_select
+    if blackbox.ENABLED:
+        blackbox.command(chan, telval)
+    if (chan == CMD_MODEL):
+        cfg_select = None if (telval == 255) else telval
+        cfg_event.set()
+    else:
+        shutdown_rx(chan, telval)
+
+def Config_loop():
+    global cfg_select
+    print ("Config watch running")
+    mtime = stat(rccfg.__file__).st_mtime
+    while True:
+        cmd = cfg_event.wait(rccfg.RELOAD_PERIOD)
+        cfg_event.clear()
+        try:
+            t = stat(rccfg.__file__).st_mtime
+        except OSError:
+            continue
+        if cmd or (t != mtime):
+            mtime = t
+            reload_model(cfg_select)
+            cfg_select = None
+
 def update(msg):  
     """ Interface for the UDP-client 
 
     hdr = 100 : update_app | hdr = 127 : trimming |hdr = 255 : servo values            
     """
-    # forward the current time to the observer queue
-    if not q_time.full(): 
-        q_time.put(time(), block=False)
     cntloop = len(msg)//3
     i = 0
-    for i in range(cntloop):
-        y = i*3
-        hdr = msg[y]
-        if (hdr == 255):
-            update_PWM(msg[y+1], msg[y+2])
-        else:
-            if (hdr == 127):
-                trimm_Chan(msg[y+1], msg[y+2])
-            elif (hdr == 100):
-                shutdown_rx(msg[y+1], msg[y+2])                
+    with out_lock:
+        chans = plan
+        for i in range(cntloop):
+            y = i*3
+            hdr = msg[y]
+            if (hdr == 255):
+                # 255 is valid on the wire, the tables end at 254
+                val = min(msg[y+2], 254)
+                if rccfg.SCHED:
+                    sched_target[msg[y+1]] = val
+                else:
+                    chans[msg[y+1]].update(val)
+            else:
+                if (hdr == 127):
+                    trimm_Chan(msg[y+1], msg[y+2])
+                elif (hdr == 100):
+                    command(msg[y+1], msg[y+2])                
+        # all channel changes of the telegram are written as one frame
+        commit_frame()
                 
 def Observer_loop():  
     print("Observer running")
     sensetime = time()
-    sleep(5.0)
+    tmtime = time()
     aval = str(rccfg.AVAL)
-    bc_data = tel_tx()
+    net_version = -1
     port_tx = rccfg.port_tx   
-    tx_address = (get_bc_address(rccfg.ifname), port_tx)
-    observed_time= time()
-    temp = time()
     
     while True:                    
-        if (not q_time.empty()):
-            observed_time = q_time.get()  # last time entry
-        while (not q_time.empty()):
-            temp = q_time.get()  
+        if (netstate.version != net_version):
+            # own address changed => Rx_BC with the new address is broadcast
+            # immediately, the transmitter is learned again
+            net_version = netstate.version
+            bc_data = tel_tx()
+            tx_address = (netstate.broadcast, port_tx)
+            tx_learned = False
+            sensetime = 0.0
         if (not q_Udp_to_OBS.empty()):
             ID, ip = q_Udp_to_OBS.get()
             if (ID == 2) :
                 tx_address = (ip, port_tx)
+                tx_learned = True
                 #print ("TX IP", ip) 
-                
-        if ((time() - observed_time) > 1.5):
-            fail_safe()
-            #print('Timeout -> Fail Save')
  
         # sensor telegram            
         if (((time() - sensetime) > 2.0)): 
-            aval = str(rccfg.AVAL)
-            if rccfg.ADS:
-                aval = ads.read_adc()
-                aval = str(ads.convert_to_V(aval, ads.EXGAIN))
-            databc = (bc_data + strfltotel(aval) + chr(13)).encode('utf-8')
+            databc = sensor_tel(bc_data)
             try:
                 if sock.sendto(databc, tx_address) == 0: 
                     print('No data sent')
             except:
                 print ("Network not available")
             sensetime = time()                        
-        sleep(0.2)      
+        # binary telemetry telegram, never broadcast
+        if rccfg.TM_PERIOD and ((time() - tmtime) >= rccfg.TM_PERIOD):
+            if tx_learned and tm_ok:
+                try:
+                    sock.sendto(telemetry(), tx_address)
+                except:
+                    print ("Network not available")
+            tmtime = time()
+        sleep(min(0.2, rccfg.TM_PERIOD or 0.2))      
+            
+def sensor_tel(bc_data):
+    '''Creates the Rx_BC telegram with the sensor value'''
+    aval = str(rccfg.AVAL)
+    # filtered value of the sampler, no bus access, None if AIN0 is not
+    # within rccfg.ADS_CHANNELS or not sampled yet
+    volt = ads.filt.get(0) if rccfg.ADS else None
+    if volt is not None:
+        aval = str(round(volt, 2))
+    return (bc_data + strfltotel(aval) + bytostr(TEL_VERSION) 
+            + bytostr(rccfg.RX_ID) + chr(13)).encode('utf-8')
             
+def wifi_signal(ifname):
+    '''(link quality, level, noise) of the interface from /proc/net/wireless'''
+    try:
+        with open('/proc/net/wireless') as f:
+            for line in f:
+                fields = line.split()
+                if fields and (fields[0] == ifname + ':'):
+                    return tuple(int(float(v)) for v in fields[2:5])
+    except (OSError, ValueError):
+        pass
+    return (0, 0, 0)
+
+def telemetry():
+    '''Creates the binary telemetry telegram'''
+    state = TM_FAILSAFE if fs_active else 0
+    link, level, noise = wifi_signal(rccfg.ifname)
+    ain = []
+    if rccfg.ADS:
+        for ch in ads.chans:
+            if ads.value(ch) is not None:
+                ain.append((ch, ads.value(ch)))
+    else:
+        ain.append((0, rccfg.AVAL))
+    stale = seq_stat['stale'] + seq_stat['reordered'] + seq_stat['duplicate']
+    tel = bytearray(TM_HDR.pack(TM_MAGIC, TM_VERSION, rccfg.RX_ID, state,
+                    seq_stat['accepted'] & 0xFFFFFFFF, 
+                    seq_stat['lost'] & 0xFFFFFFFF, stale & 0xFFFFFFFF, 
+                    stats.counters['errors'] & 0xFFFF, 
+                    wd_stat['events'] & 0xFFFF, min(max(link, 0), 255),
+                    min(max(level, -128), 127), min(max(noise, -128), 127),
+                    len(ain)))
+    for ch, volt in ain:
+        tel += TM_AIN.pack(ch, min(max(round(volt * 100), -32768), 32767))
+    return tel
+
 def decode_Tel(strtel):
     '''Decodes the incommimg control telegram and fills an array '''
     l = len(strtel)
@@ -268,26 +520,197 @@ def decode_Tel(strtel):
             tel[i] = (ord(strtel[ti])-48)*16 + (ord(strtel[ti + 1])-48)
     return tel 
 
+def hdr2_len(flags):
+    '''Length of the binary telegram header up to nmap'''
+    m = 3
+    if (flags & F_SEQ):
+        m += 6
+    if (flags & F_ADDR):
+        m += 1
+    return m
+
+def addressed_to_me(data):
+    '''False if a binary telegram is addressed to another receiver or its
+    header is incomplete
+    '''
+    if (len(data) <= hdr2_len(data[2])):
+        return False
+    if not (data[2] & F_ADDR):
+        return True
+    dest = data[hdr2_len(data[2]) - 1]
+    return (dest == 0) or (dest == rccfg.RX_ID)
+
+def decode_Tel2(data):
+    '''Decodes a binary control telegram into the same array as decode_Tel'''
+    tel = []
+    if (data[1] < 2) or (data[2] & F_RESERVED):
+        return tel
+    m = hdr2_len(data[2])
+    nmap = data[m]
+    i = m + 1 + nmap
+    for k in range(nmap):
+        bits = data[m + 1 + k]
+        chan = 8 * k
+        while bits:
+            if (bits & 1):
+                tel.extend((255, chan, data[i]))
+                i += 1
+            bits >>= 1
+            chan += 1
+    # trim and command records
+    for hdr in (127, 100):
+        cnt = data[i]
+        i += 1
+        for k in range(cnt):
+            tel.extend((hdr, data[i], data[i + 1]))
+            i += 2
+    return tel
+
+# ---------- sequence check of binary control telegrams ------------------------
+# Telegrams older than the last accepted one (reordered), duplicates and 
+# telegrams with an age above rccfg.TEL_MAXAGE are stale, their channel values
+# are dropped. The age is the one-way delay relative to the minimum delay seen
+# so far (the clocks of sender and receiver are not synchronized). The minimum
+# is kept over a restart of the sender, the telegrams queued during a stall
+# are stale. Only a sender clock stepped backwards (stale for REBASE s) sets
+# it anew.
+
+last_seq = -1          # sequence number of the last accepted telegram
+t_base = 0.0           # minimum of receive time - sender time in ms
+t_accept = 0.0         # receiver time of the last accepted telegram
+t_stale = 0.0          # receiver time of the first stale telegram, 0 => none
+REBASE = 5.0           # s of stale telegrams only => the sender clock stepped
+SEQ_RESYNC = 1.0       # s without accepted telegram => sender restarted
+DRIFT = 0.001          # ms per telegram, t_base follows the clock drift
+seq_stat = {'accepted': 0, 'lost': 0, 'reordered': 0, 'duplicate': 0, 
+            'stale': 0, 'age_last': 0.0, 'age_max': 0.0}
+
+def s32(x):
+    '''Signed 32 bit modular difference'''
+    return ((x + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+def check_seq(data):
+    '''Returns True if a binary telegram is the newest one and not stale'''
+    global last_seq, t_base, t_accept, t_stale
+    if not (data[2] & F_SEQ):
+        return True
+    seq = (data[3] << 8) | data[4]
+    ts = (data[5] << 24) | (data[6] << 16) | (data[7] << 8) | data[8]
+    now = time()
+    # signed, the clock of the sender may be ahead of the own clock
+    delta = s32(int(now * 1000) - ts)
+    if (last_seq < 0):
+        t_base = delta
+    elif t_stale and ((now - t_stale) > REBASE):
+        t_base = delta
+        t_stale = 0.0
+    if (last_seq < 0) or ((now - t_accept) > SEQ_RESYNC):
+        # first telegram or the sender has been restarted
+        last_seq = (seq - 1) & 0xFFFF
+    dseq = (seq - last_seq) & 0xFFFF
+    if (dseq == 0):
+        seq_stat['duplicate'] += 1
+        return False
+    if (dseq >= 0x8000):
+        seq_stat['reordered'] += 1
+        return False
+    seq_stat['lost'] += dseq - 1
+    last_seq = seq
+    t_base = min(delta, t_base + DRIFT)
+    age = (delta - t_base) / 1000
+    seq_stat['age_last'] = age
+    if (age > rccfg.TEL_MAXAGE):
+        seq_stat['stale'] += 1
+        if not t_stale:
+            t_stale = now
+        return False
+    t_stale = 0.0
+    seq_stat['age_max'] = max(age, seq_stat['age_max'])
+    seq_stat['accepted'] += 1
+    t_accept = now
+    return True
+
+def drop_values(msg):
+    '''Removes the channel values, trim and command records are kept'''
+    tel = []
+    for y in range(0, len(msg) - 2, 3):
+        if (msg[y] != 255):
+            tel.extend(msg[y:y + 3])
+    return tel
+
 def tel_tx():
     """Creates the string coded telegram including the owne IP
     for transmitting back to the transmitter
     """
     tel = ""
-    ip = get_ip_address(rccfg.ifname).split('.')    
+    ip = netstate.addr.split('.')    
     tel = chr(2) + "01"
     for i in range (len(ip)):
         tel = tel + bytostr(int(ip[i]))
     return tel  
 
 def strfltotel(sense):
-    '''Converts a string float value into coded string
+    '''Converts a string float value into coded string, 
+    integer part 0..255 and hundredths
     '''
-    senli = (sense).split('.')
-    tel = bytostr(int(senli[0])) + bytostr(int(senli[1]))
-    return tel
+    val = min(max(round(float(sense) * 100), 0), 25599)
+    return bytostr(val // 100) + bytostr(val % 100)
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1) 
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)   # Linux
+TS_SPACE = socket.CMSG_SPACE(struct.calcsize('ll'))
+
+def receive(data):
+    '''Decodes a received datagram (ASCII or binary) and updates the 
+    outputs. Returns the telegram ID, 2 for control telegrams, 0 for 
+    telegrams addressed to another receiver. rearmed is True if the 
+    telegram was accepted and has re-armed the watchdog.
+    '''
+    global rearmed, tm_ok
+    rearmed = False
+    if blackbox.ENABLED:
+        blackbox.telegram(data)
+    telid = 0
+    try:
+        binary = (len(data) > 4) and (data[0] == TEL2_MAGIC)
+        if binary:
+            if not addressed_to_me(data):
+                return 0
+            telid = 2
+        else:
+            data = data.decode('utf-8', 'replace')
+            telid = strtobyte(data[1:3])
+        if stats.ENABLED:
+            t0 = perf_counter()
+        fresh = True
+        if binary:
+            msg = decode_Tel2(data)
+            fresh = check_seq(data)
+        else:
+            msg = decode_Tel(data) 
+        #print (msg)
+        if not fresh:
+            msg = drop_values(msg)
+        elif (telid == 2):
+            link_alive()
+            rearmed = True
+            tm_ok = binary and bool(data[2] & F_TM)
+        if stats.ENABLED:
+            t1 = perf_counter()
+            stats.observe('decode', t1 - t0)
+            stats.count('telegrams')
+            update(msg)
+            stats.observe('update', perf_counter() - t1)
+        else:
+            update(msg)
+        if blackbox.ENABLED:
+            blackbox.values(plan)
+    except Exception as exc:
+        stats.error(exc)
+        if blackbox.ENABLED:
+            blackbox.exception(exc)
+    return telid
 
 def UDP_run():  
     print ("Start UDP ")
@@ -295,11 +718,20 @@ def UDP_run():
     Tel_ID, ip = range(2)
     UDOtoOBS = [0, ""]
     quetime = time()
+    if stats.ENABLED:
+        # kernel receive time stamps for the socket queue latency
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
     while True:
-        data, address = sock.recvfrom(1024)       
-        data = data.decode('utf-8')
+        if stats.ENABLED:
+            data, anc, flags, address = sock.recvmsg(1024, TS_SPACE)
+            for level, typ, ts in anc:
+                if (typ == SO_TIMESTAMPNS):
+                    sec, nsec = struct.unpack('ll', ts)
+                    stats.observe('recv', time() - sec - nsec / 1e9)
+        else:
+            data, address = sock.recvfrom(1024)       
         if data:
-            if (strtobyte(data[1:3]) == 2): 
+            if (receive(data) == 2): 
                 UDOtoOBS[Tel_ID] = 2
                 UDOtoOBS[ip] = address[0]
             # deliver the Tx ip to the Observer Loop
@@ -309,31 +741,184 @@ def UDP_run():
                 else:
                     print("UDP2OBS que full")
                 quetime = time()
+
+# ---------- asyncio runtime (rccfg.ASYNC) ------------------------------------
+# Replaces UDP_run and Observer_loop: control telegrams are handled by the 
+# datagram protocol, the watchdog, the sensor and the telemetry telegram by 
+# timer handles.
+
+class RxProtocol(asyncio.DatagramProtocol):
+    """Control telegram endpoint of the asyncio runtime"""
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.transport = None
+        self.tx_address = (netstate.broadcast, rccfg.port_tx)
+        self.tx_learned = False
+        self.bc_data = tel_tx()
+        netstate.subscribe(
+            lambda: self.loop.call_soon_threadsafe(self.net_changed))
+        self.wd_handle = None
+        self.ramp_time = 0.0
+        self.sense_time = self.loop.time()
+        
+    def connection_made(self, transport):
+        self.transport = transport
+        self.rearm()
+        if rccfg.SCHED:
+            self.out_time = self.loop.time()
+            self.out_step = self.out_time
+            self.loop.call_at(self.out_time, self.output)
+        self.sense_time += 2.0
+        self.loop.call_at(self.sense_time, self.sense)
+        if rccfg.TM_PERIOD:
+            self.loop.call_later(rccfg.TM_PERIOD, self.telemetry)
+        if stats.ENABLED:
+            self.loop.call_later(rccfg.METRICS_PERIOD, self.metrics)
+        
+    def datagram_received(self, data, address):
+        if data and (receive(data) == 2):
+            self.tx_address = (address[0], rccfg.port_tx)
+            self.tx_learned = True
+            # duplicate, stale and reordered telegrams do not re-arm
+            if rearmed:
+                self.rearm()
+            
+    def rearm(self):
+        """Restarts the link loss timeout"""
+        if self.wd_handle is not None:
+            self.wd_handle.cancel()
+        self.wd_handle = self.loop.call_later(rccfg.WD_TIMEOUT, self.expired)
+        
+    def expired(self):
+        """Link lost, the fail safe state is kept until the next control 
+        telegram
+        """
+        self.wd_handle = None
+        if fs_active:
+            return
+        if enter_failsafe():
+            self.ramp_time = time()
+            self.wd_handle = self.loop.call_later(FS_CYCLE, self.ramp)
+            
+    def ramp(self):
+        now = time()
+        if ramp_failsafe(now - self.ramp_time):
+            self.wd_handle = self.loop.call_later(FS_CYCLE, self.ramp)
+        else:
+            self.wd_handle = None
+        self.ramp_time = now
+        
+    def output(self):
+        """Output scheduler, called once per servo frame"""
+        now = self.loop.time()
+        try:
+            sched_step(now - self.out_step)
+        except Exception as exc:
+            print ("Output scheduler: " + repr(exc))
+            stats.error(exc)
+        self.out_step = now
+        self.out_time += 1 / rccfg.FREQ
+        if (self.out_time < now):
+            self.out_time = now
+        self.loop.call_at(self.out_time, self.output)
+        
+    def metrics(self):
+        stats.write_file()
+        self.loop.call_later(rccfg.METRICS_PERIOD, self.metrics)
+        
+    def sense(self):
+        """Sends the sensor telegram every 2 s"""
+        try:
+            self.transport.sendto(sensor_tel(self.bc_data), self.tx_address)
+        except:
+            print ("Network not available")
+        self.sense_time += 2.0
+        self.loop.call_at(self.sense_time, self.sense)
+
+    def net_changed(self):
+        """Own address changed, Rx_BC with the new address is broadcast
+        immediately, the transmitter is learned again
+        """
+        self.tx_address = (netstate.broadcast, rccfg.port_tx)
+        self.tx_learned = False
+        self.bc_data = tel_tx()
+        try:
+            self.transport.sendto(sensor_tel(self.bc_data), self.tx_address)
+        except:
+            print ("Network not available")
+
+    def telemetry(self):
+        """Sends the telemetry telegram every rccfg.TM_PERIOD s to the
+        learned transmitter if it accepts it, never broadcast
+        """
+        if self.tx_learned and tm_ok:
             try:
-                msg = decode_Tel(data) 
-                #print (msg)
-                update(msg)
+                self.transport.sendto(telemetry(), self.tx_address)
             except:
-                msg = []                                      
+                print ("Network not available")
+        self.loop.call_later(rccfg.TM_PERIOD, self.telemetry)
+        
+async def aio_run():
+    print ("Start asyncio runtime")
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(RxProtocol, 
+            local_addr=('0.0.0.0', rccfg.port_rx), allow_broadcast=True)
+    await loop.create_future()   # runs forever
+                    
+def process_age():
+    '''Time since the start of the process in s'''
+    try:
+        with open('/proc/self/stat') as f:
+            # the name (field 2) may contain blanks, starttime is field 22
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (clock_gettime(CLOCK_BOOTTIME)
+                - int(fields[19]) / sysconf('SC_CLK_TCK'))
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+def boot_time():
+    '''Time of the first fail safe frame since kernel boot and since the
+    start of the process in s
+    '''
+    return {'since_boot': round(clock_gettime(CLOCK_BOOTTIME), 3),
+            'since_start': round(process_age(), 3)}
                     
 def main():   
-    while (get_ip_address(rccfg.ifname) == "127.0.0.0"):
-        print ("waiting for networking")
-        sleep(1)                   
-    CtrData_init()
-    # init hardware boards
+    # the outputs are set to fail safe first, the network is not
+    # required for that
+    load_model(rccfg.MODEL)
     PWM.init()
     PWM.set_pwm_freq(rccfg.FREQ)
+    fail_safe()
+    boot = boot_time()
+    print ("first frame", boot)
+    if blackbox.ENABLED:
+        blackbox.init()
+        PWM.write_hook = blackbox.reg_write
     if rccfg.ADS:
         ads.init()
-    # setting the configuration data for the selected model
-    for data in rccfg.models[rccfg.MODEL]:
-        configure_channel(data[0],data[1],data[2],data[3],\
-                       data[4],data[5],data[6],data[7])
-        
-    fail_safe()   
-    Thread(target = Observer_loop).start()
-    UDP_run()
+        Thread(target = ads.Sampler_loop, daemon = True).start()
+    netstate.wait_for_address(rccfg.ifname)
+    if rccfg.RELOAD:
+        Thread(target = Config_loop, daemon = True).start()
+    if stats.ENABLED:
+        stats.register('i2c', lambda: PWM.stat)
+        stats.register('i2c_sched', lambda: PWM.sched_stat)
+        stats.register('watchdog', wd_statistics)
+        stats.register('seq', lambda: seq_stat)
+        stats.register('boot', lambda: boot)
+        if rccfg.ADS:
+            stats.register('ads', ads.statistics)
+        if not rccfg.ASYNC:
+            Thread(target = stats.Metrics_loop).start()
+    if rccfg.ASYNC:
+        asyncio.run(aio_run())
+    else:
+        Thread(target = Watchdog_loop).start()
+        if rccfg.SCHED:
+            Thread(target = Output_loop).start()
+        Thread(target = Observer_loop).start()
+        UDP_run()
   
 if __name__ == '__main__':
     main()
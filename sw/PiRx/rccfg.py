@@ -13,9 +13,39 @@
 # ---------------------------------------------------------------------------- 
 ADS = False       # configure either the ADS1115 Board is available or not
 AVAL = 0.0       # default value for analog input
+ADS_CHANNELS = (0, 1, 2, 3)  # AIN inputs sampled round robin
+ADS_SPS = 128    # data rate of the ADS1115 (8..860 samples/s for all inputs)
+ADS_RING = 64    # samples of each input kept for min, mean and max
+ADS_FILT = 0.2   # coefficient of the low pass filter, 1.0 => no filtering
+ADS_DIVIDER = {0: 5.69}  # external voltage divider of the inputs, default 1.0
 SIM = False      # running for test and integration on a PC
+SIM_I2C_HZ = 100000   # bus clock of the simulated I2C bus (100 or 400 kHz)
+SIM_T_TRANS = 0.00005 # fixed cost of a simulated I2C transaction in s
+ASYNC = False    # asyncio runtime instead of the UDP and observer threads
+SCHED = False    # output scheduler with slew limiting at the servo frame rate
+RELOAD = True    # models and MODEL are reloaded when this file is changed
+RELOAD_PERIOD = 1.0   # s between two checks of the file
+TAB_CACHE = '/var/tmp/rcpi'   # cache of the impulse tables, '' => none
+WD_TIMEOUT = 0.25 # link loss timeout in s, the outputs are set to fail safe
+TEL_MAXAGE = 0.1 # control telegrams delayed by more than this (s) are dropped
+TM_PERIOD = 0.5  # s between two binary telemetry telegrams, 0 => none
+METRICS = False  # latency histograms and counters of the receiver 
+METRICS_FILE = '/tmp/rcpi.prom'  # Prometheus text file, rewritten periodically
+METRICS_PERIOD = 5.0
+# black box: last telegrams, channel values and register writes (64 bytes per
+# record, about 4 records per telegram), written on fail safe, exception and
+# shutdown, list: python3 blackbox.py.  '' => off
+BB_FILE = '/var/tmp/rcpi/blackbox.bin'
+BB_SLOTS = 4096
 # PCA9685 Parameter
 FREQ = 50.0 
+# PCA9685 boards {board : (I2C bus, address)}, the boards are numbered 
+# from 0 without gaps, the channels of board n are 16 * n .. 16 * n + 15 
+boards = {0: (1, 0x40)}
+#boards = {0: (1, 0x40), 1: (1, 0x41), 2: (0, 0x40)}   # 48 channels
+# ID of this receiver (1..255), announced within the Rx_BC telegram, 
+# control telegrams addressed to other receivers are ignored
+RX_ID = 1
 port_tx = 6000
 port_rx = 6100
 
@@ -25,18 +55,25 @@ else:
     ifname = "wlp2s0"
 
 SERVO, DIO, L298 = range(3)  
+HOLD, JUMP, RAMP = range(3)   # fail safe strategies
 
 '''
 Parameter for channel configuration 
-(MODE, CHANNEL, CENTER, RATE, REVERSE, ACCFILT, FAILSAFE, STEPW)
+(MODE, CHANNEL, CENTER, RATE, REVERSE, ACCFILT, FAILSAFE, STEPW [,FSMODE, FSRATE])
 MODE = SERVO, DIO or L298
-CHANNEL = 0..15
+CHANNEL = 0..16 * count of boards - 1
 CENTER = center position of servo in ms
 RATE = max. diviation from center in ms 
 REVERSE = boolean reverse orientation 
 ACCFILT = boolean, using a filter or not to degrease the rising rate of values
 FAILSAFE = 0..254 
 STEPW = max. steps af rate within of cycle rate of 20 ms used by the filter
+FSMODE = fail safe strategy on link loss, optional (default JUMP)
+         HOLD = keep last value, JUMP = set FAILSAFE, RAMP = ramp to FAILSAFE 
+FSRATE = ramp rate in steps per s for FSMODE = RAMP
+A L298 channel uses CHANNEL + 1 and CHANNEL + 2 as IN1 and IN2, they must not
+be configured. The configuration is checked by chplan.compile_plan at start up
+(python3 chplan.py checks all models).
 '''
 
 models = {
@@ -49,11 +86,12 @@ models = {
     
      'MyBoat'  : [(SERVO, 0, 1.5, 0.5, False, True, 127, 10), 
                  (SERVO, 3, 1.5, 0.45, True, False, 127, 127)],
+     # throttle ramped to FAILSAFE within about 0.5 s on link loss
+     #'MyBoat'  : [(SERVO, 0, 1.5, 0.5, False, True, 127, 10, RAMP, 250),
+     #            (SERVO, 3, 1.5, 0.45, True, False, 127, 127)],
                 
      'CASPARCAR': [(L298, 0, 1.5, 0.5, False, False, 127, 127), 
-                  (SERVO,3, 1.5, 0.25, True, False, 127, 127),
-                  (DIO, 1, 1.5, 0.5, True, False, 0, 127),
-                  (DIO, 2, 1.5, 0.5, True, False, 254, 127)] }
+                  (SERVO,3, 1.5, 0.25, True, False, 127, 127)] }
   
 MODEL = 'MyBoat'
 
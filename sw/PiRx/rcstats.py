@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        Statistics of the Remote Control Receiver
+# Purpose:     Latency histograms of the receiver stages and counters,
+#              exported as Prometheus text file that is rewritten periodically
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+import os
+from bisect import bisect_left
+from time import time, sleep
+import rccfg
+
+# The callers check ENABLED before taking any time stamp, so the
+# instrumentation costs one attribute lookup when the metrics are disabled.
+ENABLED = rccfg.METRICS
+
+# upper bounds of the histogram buckets in s
+BUCKETS = (0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005,
+           0.01, 0.02, 0.05, 0.1)
+# stages of the receiver hot path
+# recv = socket queue (kernel time stamp until the telegram is read)
+# decode = decode_Tel/decode_Tel2, update = update(), i2c = PWM.commit()
+STAGES = ('recv', 'decode', 'update', 'i2c')
+
+hist = {}      # stage: counts per bucket, the last cell counts > BUCKETS[-1]
+hsum = {}      # stage: sum of all observed times
+for stage in STAGES:
+    hist[stage] = [0] * (len(BUCKETS) + 1)
+    hsum[stage] = 0.0
+counters = {'telegrams': 0, 'errors': 0}
+last_error = ""
+last_error_time = 0.0
+# the errors of the hot path are printed once within ERROR_PRINT s
+ERROR_PRINT = 5.0
+t_error_print = 0.0
+# name: function returning a dict of numbers, exported as rcpi_<name>_<key>
+sources = {}
+
+def observe(stage, dt):
+    '''Adds the time dt (s) of a stage to its histogram'''
+    hist[stage][bisect_left(BUCKETS, dt)] += 1
+    hsum[stage] += dt
+
+def count(name, n=1):
+    counters[name] = counters.get(name, 0) + n
+
+def error(exc):
+    '''Counts an exception of the hot path and keeps its description,
+    printed once within ERROR_PRINT s (with the count of the errors)
+    '''
+    global last_error, last_error_time, t_error_print
+    counters['errors'] += 1
+    last_error = repr(exc)
+    last_error_time = time()
+    if ((last_error_time - t_error_print) >= ERROR_PRINT):
+        t_error_print = last_error_time
+        print ("Error " + str(counters['errors']) + ": " + last_error)
+
+def register(name, func):
+    '''Registers statistics of other modules for the export'''
+    sources[name] = func
+
+def export():
+    '''Returns all statistics in the Prometheus text format'''
+    lines = ['# TYPE rcpi_stage_seconds histogram']
+    for stage in STAGES:
+        cnt = 0
+        for i in range(len(BUCKETS)):
+            cnt += hist[stage][i]
+            lines.append('rcpi_stage_seconds_bucket{stage="%s",le="%g"} %d'
+                         % (stage, BUCKETS[i], cnt))
+        cnt += hist[stage][-1]
+        lines.append('rcpi_stage_seconds_bucket{stage="%s",le="+Inf"} %d'
+                     % (stage, cnt))
+        lines.append('rcpi_stage_seconds_sum{stage="%s"} %g'
+                     % (stage, hsum[stage]))
+        lines.append('rcpi_stage_seconds_count{stage="%s"} %d' % (stage, cnt))
+    for name in counters:
+        lines.append('rcpi_%s_total %d' % (name, counters[name]))
+    if last_error:
+        # label value escaping of the text format
+        err = last_error.replace('\\', '\\\\').replace('"', '\\"')
+        err = err.replace('\n', '\\n')
+        lines.append('rcpi_last_error_info{error="%s"} 1' % err)
+        lines.append('rcpi_last_error_time %d' % last_error_time)
+    for name in sources:
+        try:
+            stat = sources[name]()
+        except Exception as exc:
+            print ("Statistics " + name + " failed: " + repr(exc))
+            continue
+        for key in stat:
+            val = stat[key]
+            if isinstance(val, (bool, int, float)):
+                lines.append('rcpi_%s_%s %r' % (name, key, float(val)))
+    lines.append('rcpi_export_time %d' % time())
+    return '\n'.join(lines) + '\n'
+
+def write_file(path=rccfg.METRICS_FILE):
+    '''Rewrites the metrics file, readers never see a partial file'''
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            f.write(export())
+        os.replace(tmp, path)
+    except OSError as exc:
+        print ("Metrics file not written: " + repr(exc))
+
+def Metrics_loop():
+    print("Metrics export running")
+    while True:
+        sleep(rccfg.METRICS_PERIOD)
+        write_file()
+
+def main():
+    print (export())
+
+if __name__ == '__main__':
+    main()
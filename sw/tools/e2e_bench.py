@@ -0,0 +1,173 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        Loopback end-to-end latency benchmark
+# Purpose:     Feeds synthetic gamepad events into GPapp, runs rcapp against
+#              the simulated I2C bus on localhost and measures the latency
+#              from the input event to the first register write
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+# Usage:  python3 e2e_bench.py [-n SAMPLES] [--ascii] [--sched] [--delta] 
+#                              [--hz HZ] [--realtime] [--model MODEL]
+# Needs netifaces (localhost interface 'lo'), evdev is not used.
+import os
+import sys
+import argparse
+import queue
+import random
+from statistics import mean, pstdev
+from threading import Thread, Event
+from time import perf_counter, sleep
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'PiRx'))
+sys.path.insert(0, os.path.join(HERE, '..', 'GamepadTx'))
+
+import rccfg
+import GPcfg
+
+EV_ABS = 3
+
+class FakeEvent():
+    __slots__ = ('type', 'code', 'value')
+    def __init__(self, typ, code, value):
+        self.type = typ
+        self.code = code
+        self.value = value
+
+class FakeInputDevice():
+    """Replaces evdev.InputDevice, the events are injected by push()"""
+    def __init__(self):
+        self.q = queue.Queue()
+
+    def push(self, code, value, typ=EV_ABS):
+        self.q.put(FakeEvent(typ, code, value))
+
+    def read_loop(self):
+        while True:
+            yield self.q.get()
+
+def configure(args):
+    '''Must run before rcapp and GPapp are imported'''
+    rccfg.SIM = True
+    rccfg.METRICS = True
+    rccfg.SCHED = args.sched
+    rccfg.SIM_I2C_HZ = args.hz
+    rccfg.ifname = 'lo'
+    rccfg.MODEL = args.model
+    GPcfg.ifname = 'lo'
+    GPcfg.PC = True
+    GPcfg.DELTA = args.delta
+
+def percentile(vals, p):
+    return vals[min(len(vals) - 1, int(len(vals) * p / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description='RC-Pi loopback latency')
+    parser.add_argument('-n', type=int, default=200, help='samples')
+    parser.add_argument('--ascii', action='store_true',
+                        help='ASCII telegrams instead of version 2')
+    parser.add_argument('--sched', action='store_true',
+                        help='receiver with output scheduler')
+    parser.add_argument('--delta', action='store_true',
+                        help='change triggered sending of the transmitter')
+    parser.add_argument('--hz', type=int, default=100000, help='I2C clock')
+    parser.add_argument('--realtime', action='store_true',
+                        help='simulated bus blocks for the transaction time')
+    parser.add_argument('--model', default=rccfg.MODEL)
+    args = parser.parse_args()
+    configure(args)
+
+    import pca9685 as PWM
+    import rcapp
+    import GPapp
+    import netstate
+    netstate.start('lo')
+
+    # ---------- receiver -------------------------------------------------
+    rcapp.load_model(rccfg.MODEL)
+    PWM.init()
+    PWM.set_pwm_freq(rccfg.FREQ)
+    rcapp.fail_safe()
+    PWM.bus.realtime = args.realtime
+
+    code = list(GPcfg.analogEvent)[0]
+    chan = GPcfg.analogEvent[code][GPapp.CH]
+    base = PWM.LED0_ON_L + 4 * chan
+    written = Event()
+    t_write = [0.0]
+
+    def listener(dev, reg, vals):
+        if (reg < base + 4) and (reg + len(vals) > base):
+            t_write[0] = perf_counter()
+            written.set()
+    PWM.bus.listener = listener
+
+    Thread(target=rcapp.Watchdog_loop, daemon=True).start()
+    if rccfg.SCHED:
+        Thread(target=rcapp.Output_loop, daemon=True).start()
+    Thread(target=rcapp.UDP_run, daemon=True).start()
+    # the Observer_loop is not started (no Rx_BC and telemetry traffic),
+    # the transmitter addresses reported by UDP_run are discarded
+    def drain():
+        while True:
+            rcapp.q_Udp_to_OBS.get()
+    Thread(target=drain, daemon=True).start()
+
+    # ---------- transmitter ----------------------------------------------
+    dev = FakeInputDevice()
+    GPapp.gamepad = dev
+    GPapp.create_ValCorr()
+    # the receiver is addressed by unicast (the broadcast is ASCII only),
+    # its Rx_BC entry is set here
+    GPcfg.receivers = {rccfg.RX_ID: tuple(
+        GPcfg.analogEvent[ev][GPapp.CH] for ev in GPcfg.analogEvent)}
+    GPapp.rx_table[rccfg.RX_ID] = [
+        '127.0.0.1', 1 if args.ascii else GPapp.TEL_VERSION]
+    Thread(target=GPapp.GP_loop, daemon=True).start()
+    Thread(target=GPapp.UDP_run, daemon=True).start()
+    sleep(0.5)
+
+    # ---------- measurement ----------------------------------------------
+    lo = GPcfg.analogEvent[code][GPapp.MIN] + 10
+    hi = GPcfg.analogEvent[code][GPapp.MAX] - 10
+    lat = []
+    lost = 0
+    tel_start = rcapp.stats.counters['telegrams']
+    t_start = perf_counter()
+    for i in range(args.n):
+        # wait until the channel is settled (acc filter, scheduler)
+        while written.wait(0.15):
+            written.clear()
+        # random phase against the 30 ms loop of the transmitter
+        sleep(random.uniform(0, 0.03))
+        written.clear()
+        t_in = perf_counter()
+        dev.push(code, hi if (i % 2) else lo)
+        if written.wait(1.0):
+            lat.append(t_write[0] - t_in)
+        else:
+            lost += 1
+    duration = perf_counter() - t_start
+    telegrams = rcapp.stats.counters['telegrams'] - tel_start
+
+    lat.sort()
+    print ("protocol     ", "ASCII" if args.ascii else "binary v2")
+    print ("scheduler    ", rccfg.SCHED)
+    print ("delta        ", GPcfg.DELTA)
+    print ("samples      ", len(lat), "lost", lost)
+    if lat:
+        print ("p50     ms   ", round(percentile(lat, 50) * 1000, 2))
+        print ("p99     ms   ", round(percentile(lat, 99) * 1000, 2))
+        print ("max     ms   ", round(lat[-1] * 1000, 2))
+        print ("mean    ms   ", round(mean(lat) * 1000, 2))
+        print ("jitter  ms   ", round(pstdev(lat) * 1000, 2))
+    print ("telegrams/s  ", round(telegrams / duration, 1))
+    print ("bus          ", PWM.bus.report())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        Replay of a flight recorder file
+# Purpose:     Sends the telegrams recorded by GPapp (GPcfg.REC_FILE) to a
+#              receiver over UDP or feeds them into rcapp against the
+#              simulated I2C bus, at the original or a changed speed
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+# Usage:  python3 replay.py FILE [--speed X] [--dest IP]
+#                               [--host HOST] [--port PORT]
+#         python3 replay.py FILE --local [--speed X] [--model MODEL]
+# --speed 0 => as fast as possible, --dest => telegrams to this address only
+# The sequence number and the time stamp of binary telegrams (F_SEQ) are
+# replaced when they are sent, otherwise the receiver drops the values as
+# stale (speed < 1) or reordered (recording across a restart of GPapp).
+# --original sends the recorded headers unchanged.
+import os
+import sys
+import socket
+import struct
+import argparse
+from time import time, perf_counter, sleep
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'PiRx'))
+sys.path.insert(0, os.path.join(HERE, '..', 'GamepadTx'))
+
+import rccfg
+import GPcfg
+import flightrec
+
+# binary control telegram - see rcapp.decode_Tel2
+TEL2_MAGIC = 0xB2
+F_SEQ = 0x02
+F_ADDR = 0x04
+SEQ_TS = struct.Struct('>HI')
+SEQ_OFF = 3          # offset of the sequence number, the receiver ID follows
+
+def telegrams(path, dest=None):
+    '''(time, telegram) of the recorded telegrams, optionally of one
+    destination address only
+    '''
+    return [(t, payload[1]) for t, kind, payload in flightrec.read(path)
+            if (kind == flightrec.TEL) and (dest in (None, payload[0]))]
+
+def restamp(tel, seqs):
+    '''Binary telegram with a new sequence number (continuous for each
+    receiver ID) and the current time stamp
+    '''
+    if (len(tel) <= SEQ_OFF + SEQ_TS.size) or (tel[0] != TEL2_MAGIC) or \
+       not (tel[2] & F_SEQ):
+        return tel
+    rx_id = tel[SEQ_OFF + SEQ_TS.size] if (tel[2] & F_ADDR) else 0
+    seq = (seqs.get(rx_id, -1) + 1) & 0xFFFF
+    seqs[rx_id] = seq
+    tel = bytearray(tel)
+    SEQ_TS.pack_into(tel, SEQ_OFF, seq, int(time() * 1000) & 0xFFFFFFFF)
+    return bytes(tel)
+
+def replay(tels, send, speed=1.0, original=False):
+    '''Calls send(telegram) for each telegram at its recorded time divided
+    by speed (0 => without waiting), returns the run time in s.
+    The binary headers are stamped again unless original is set.
+    '''
+    t_start = perf_counter()
+    if not tels:
+        return 0.0
+    t0 = tels[0][0]
+    seqs = {}
+    for t, tel in tels:
+        if speed:
+            wait = t_start + (t - t0) / speed - perf_counter()
+            if (wait > 0):
+                sleep(wait)
+        if not original:
+            tel = restamp(tel, seqs)
+        send(tel)
+    return perf_counter() - t_start
+
+def percentile(vals, p):
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, len(vals) * p // 100)]
+
+def run_udp(tels, args):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    address = (args.host, args.port)
+    dur = replay(tels, lambda tel: sock.sendto(tel, address), args.speed,
+                 args.original)
+    print ("telegrams", len(tels), "to", address, "in", round(dur, 3), "s")
+
+def run_local(tels, args):
+    rccfg.SIM = True
+    import pca9685 as PWM
+    import rcapp
+    rcapp.load_model(args.model)
+    PWM.init()
+    PWM.set_pwm_freq(rccfg.FREQ)
+    rcapp.fail_safe()
+    bus = PWM.bus
+    bus.reset()
+    lat = []
+    def send(tel):
+        busy = bus.busy
+        rcapp.receive(tel)
+        lat.append(bus.busy - busy)
+    dur = replay(tels, send, args.speed, args.original)
+    print ("telegrams", len(tels), "in", round(dur, 3), "s")
+    if lat:
+        print ("bus per telegram p50 ms", round(percentile(lat, 50) * 1e3, 3),
+               "p99 ms", round(percentile(lat, 99) * 1e3, 3),
+               "max ms", round(max(lat) * 1e3, 3))
+    for key, val in bus.report().items():
+        print (key, val)
+
+def main():
+    parser = argparse.ArgumentParser(description='RC-Pi flight recorder replay')
+    parser.add_argument('file', help='flight recorder file')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, 0 => as fast as possible')
+    parser.add_argument('--dest', help='telegrams to this address only')
+    parser.add_argument('--host', default='127.0.0.1', help='receiver')
+    parser.add_argument('--port', type=int, default=GPcfg.receiver_port)
+    parser.add_argument('--local', action='store_true',
+                        help='rcapp with the simulated I2C bus, no network')
+    parser.add_argument('--model', default=rccfg.MODEL)
+    parser.add_argument('--original', action='store_true',
+                        help='recorded sequence numbers and time stamps')
+    args = parser.parse_args()
+    tels = telegrams(args.file, args.dest)
+    if args.local:
+        run_local(tels, args)
+    else:
+        run_udp(tels, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# Name:        Check of the telegram sequence check
+# Purpose:     Feeds binary control telegrams with simulated send and
+#              receive times into rcapp.check_seq (stall with backlog,
+#              sender restart, clock offset and clock step)
+# Author:      Bernd Hinze
+#
+# Created:     30.01.2020
+# Copyright:   (c) Bernd Hinze 2020
+# Licence:     MIT see https://opensource.org/licenses/MIT
+# -----------------------------------------------------------------------------
+# Usage:  python3 seq_check.py   (or pytest seq_check.py)
+import os
+import sys
+import random
+import struct
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'PiRx'))
+
+import rccfg
+rccfg.SIM = True
+rccfg.BB_FILE = ''
+import rcapp
+
+PERIOD = 0.03      # s between two telegrams of the transmitter
+T0 = 1000.0
+
+def telegram(seq, t_send):
+    return (bytes([rcapp.TEL2_MAGIC, 2, rcapp.F_SEQ])
+            + struct.pack('>HI', seq & 0xFFFF, int(t_send * 1000) & 0xFFFFFFFF)
+            + bytes([0, 0, 0]))
+
+def reset():
+    rcapp.last_seq = -1
+    rcapp.t_base = 0.0
+    rcapp.t_accept = 0.0
+    rcapp.t_stale = 0.0
+    for key in rcapp.seq_stat:
+        rcapp.seq_stat[key] = 0
+
+def feed(tels):
+    '''tels = [(receive time, seq, send time)], returns the accepted ones'''
+    ok = []
+    for t_recv, seq, t_send in tels:
+        rcapp.time = lambda: t_recv
+        if rcapp.check_seq(telegram(seq, t_send)):
+            ok.append((t_recv, seq, t_send))
+    return ok
+
+def link(t_start, n, seq0=0, offset=0.0, delay=0.002):
+    '''n telegrams, sender clock ahead by offset s'''
+    return [(t_start + i * PERIOD + delay, seq0 + i,
+             t_start + i * PERIOD + offset) for i in range(n)]
+
+def stall(gap):
+    '''1 s link, then the telegrams of gap s are held back and delivered
+    at once, returns (accepted of the backlog, backlog)
+    '''
+    reset()
+    feed(link(T0, 34))
+    t_gap = T0 + 34 * PERIOD
+    n = int(gap / PERIOD)
+    backlog = [(t_gap + gap + 0.001 * i, 34 + i, t_gap + i * PERIOD)
+               for i in range(n)]
+    return feed(backlog), backlog
+
+def test_stall_beyond_resync():
+    ok, backlog = stall(1.5)
+    # only the telegrams sent within TEL_MAXAGE before the delivery
+    assert ok and all((t_recv - t_send) <= rccfg.TEL_MAXAGE + 0.01
+                      for t_recv, seq, t_send in ok), ok
+    assert len(ok) <= 5
+
+def test_stall_below_resync():
+    ok, backlog = stall(0.5)
+    assert len(ok) <= 5
+
+def test_sender_restart():
+    reset()
+    feed(link(T0, 34, seq0=500))
+    ok = feed(link(T0 + 3.0, 20, seq0=0))
+    assert len(ok) == 20
+
+def test_sender_clock_ahead():
+    reset()
+    random.seed(1)
+    tels = [(T0 + i * PERIOD + random.uniform(0, 0.003), i,
+             T0 + i * PERIOD + 0.002) for i in range(2000)]
+    assert len(feed(tels)) == 2000
+
+def test_sender_clock_step_back():
+    reset()
+    feed(link(T0, 34))
+    # sender clock 10 s back: stale for REBASE s, then accepted again
+    t1 = T0 + 2.0
+    n = int((rcapp.REBASE + 1.0) / PERIOD)
+    ok = feed(link(t1, n, seq0=34, offset=-10.0))
+    assert ok and (ok[0][0] - t1) >= rcapp.REBASE
+
+def main():
+    failed = 0
+    for name, func in sorted(globals().items()):
+        if name.startswith('test_'):
+            try:
+                func()
+                print (name, "ok")
+            except AssertionError as exc:
+                failed += 1
+                print (name, "FAILED", exc)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()